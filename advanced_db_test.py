@@ -3,8 +3,49 @@
 Advanced database test queries for RTPlanDB
 """
 
-import sqlite3
+import sys
 from pathlib import Path
+from db_utils import open_connection, ensure_indexes
+
+# Every PatientID in this dataset starts with 'GammaKnife-Hippocampal-', so an
+# anchored GLOB lets SQLite seek the PatientID indexes instead of scanning
+PATIENT_GLOB = 'GammaKnife-Hippocampal*'
+
+def analyze_indexes(cursor):
+    """Create the shared indexes and refresh the planner statistics"""
+    ensure_indexes(cursor)
+    # Refresh sqlite_stat1 so the planner picks join order from real index
+    # selectivity; analysis_limit keeps ANALYZE to a sample on big tables
+    cursor.executescript('''
+        PRAGMA analysis_limit=1000;
+        ANALYZE;
+    ''')
+
+# Classification flags shared by Tests 4, 5 and 10, evaluated once per MR row
+MR_TAGS = {
+    'is_t1': "SeriesDescription LIKE '%T1%' OR ProtocolName LIKE '%T1%'",
+    'is_t2': "SeriesDescription LIKE '%T2%' OR ProtocolName LIKE '%T2%'",
+    'is_contrast': ("SeriesDescription LIKE '%contrast%' OR SeriesDescription LIKE '%post%' "
+                    "OR SeriesDescription LIKE '%Gd%' OR SeriesDescription LIKE '%gadolinium%'"),
+    'is_mprage': "SeriesDescription LIKE '%MPRAGE%'",
+    'is_fspgr': "SeriesDescription LIKE '%FSPGR%'",
+    'is_tfl3d': "SequenceName LIKE '%tfl3d%'",
+    'is_tse': "SequenceName LIKE '%tse%' OR SeriesDescription LIKE '%TSE%'",
+    'is_fiesta': "SeriesDescription LIKE '%FIESTA%'"
+}
+
+def build_mr_tags(cursor):
+    """Materialize the MR classification flags into a session temp table"""
+    # LIKE on a NULL column is NULL, so a row matching nothing would store NULL
+    # instead of 0; COALESCE keeps every flag 0 or 1 for the SUMs below
+    flags = ',\n'.join(f'COALESCE(({condition}), 0) AS {name}' for name, condition in MR_TAGS.items())
+    cursor.execute(f'''
+        CREATE TEMP TABLE IF NOT EXISTS mr_tags AS
+        SELECT substr(StudyDate, 1, 4) AS year,
+               {flags}
+        FROM MR
+        WHERE PatientID GLOB ?
+    ''', (PATIENT_GLOB,))
 
 def advanced_database_tests():
     db_path = '/mnt/c/ARTDaemon/Segman/Imports/Dcm/GK-Hippo/DataBase/plandb/RTPlanDB.sqlite'
@@ -13,82 +54,91 @@ def advanced_database_tests():
         print(f"❌ Database not found at {db_path}")
         return
     
-    conn = sqlite3.connect(db_path)
+    conn = open_connection(db_path)
     cursor = conn.cursor()
+    analyze_indexes(cursor)
+    build_mr_tags(cursor)
 
     print('=== Advanced RTPlanDB Database Queries ===\n')
 
     # Test 1: Find patients by gender and count their studies
     print('1. Patient demographics with study counts:')
+    # Filter patients first so the LEFT JOIN only probes STUDY for matches
     cursor.execute('''
-        SELECT p.PatientID, p.PatientSex, COUNT(DISTINCT s.StudyInstanceUID) as study_count
-        FROM PATIENT p
-        LEFT JOIN STUDY s ON p.PatientID = s.PatientID
-        WHERE p.PatientID LIKE '%Hippocampal%'
-        GROUP BY p.PatientID, p.PatientSex
+        WITH hippo AS (
+            SELECT PatientID, PatientSex FROM PATIENT WHERE PatientID GLOB ?
+        )
+        SELECT h.PatientID, h.PatientSex, COUNT(DISTINCT s.StudyInstanceUID) as study_count
+        FROM hippo h
+        LEFT JOIN STUDY s ON s.PatientID = h.PatientID
+        GROUP BY h.PatientID, h.PatientSex
         ORDER BY study_count DESC
         LIMIT 5
-    ''')
-    for row in cursor.fetchall():
-        print(f'   {row[0]} | {row[1]} | {row[2]} studies')
+    ''', (PATIENT_GLOB,))
+    sys.stdout.write(''.join(
+        f'   {row[0]} | {row[1]} | {row[2]} studies\n' for row in cursor
+    ))
 
     print()
 
     # Test 2: Find MR sequences by manufacturer and date range
     print('2. MR sequences by manufacturer (2008-2009):')
     cursor.execute('''
-        SELECT Manufacturer, SeriesDescription, COUNT(*) as count
+        SELECT substr(Manufacturer, 1, 20) || CASE WHEN length(Manufacturer) > 20 THEN '...' ELSE '' END,
+               substr(SeriesDescription, 1, 30) || CASE WHEN length(SeriesDescription) > 30 THEN '...' ELSE '' END,
+               COUNT(*) as count
         FROM MR
         WHERE StudyDate BETWEEN '20080101' AND '20091231'
-        AND PatientID LIKE '%Hippocampal%'
+        AND PatientID GLOB ?
         GROUP BY Manufacturer, SeriesDescription
         ORDER BY count DESC
         LIMIT 5
-    ''')
-    for row in cursor.fetchall():
-        manufacturer = row[0][:20] + '...' if len(row[0]) > 20 else row[0]
-        description = row[1][:30] + '...' if len(row[1]) > 30 else row[1]
-        print(f'   {manufacturer} | {description} | {row[2]} series')
+    ''', (PATIENT_GLOB,))
+    sys.stdout.write(''.join(
+        f'   {row[0]} | {row[1]} | {row[2]} series\n' for row in cursor
+    ))
 
     print()
 
     # Test 3: Find studies with multiple modalities
     print('3. Studies with both MR and CT data:')
+    # EXISTS stops at the first matching series and discards studies before
+    # any aggregation; the counts then run only for the surviving studies,
+    # probing MR/CT through their PatientID-led indexes
     cursor.execute('''
-        SELECT s.StudyInstanceUID, s.PatientID, s.StudyDate, s.StudyDescription,
-               COUNT(DISTINCT mr.SeriesInstanceUID) as mr_series,
-               COUNT(DISTINCT ct.SeriesInstanceUID) as ct_series
+        SELECT substr(s.StudyInstanceUID, 1, 30) || '...', s.PatientID, s.StudyDate,
+               substr(s.StudyDescription, 1, 40) || CASE WHEN length(s.StudyDescription) > 40 THEN '...' ELSE '' END,
+               (SELECT COUNT(DISTINCT mr.SeriesInstanceUID) FROM MR mr
+                WHERE mr.PatientID = s.PatientID AND mr.StudyInstanceUID = s.StudyInstanceUID) as mr_series,
+               (SELECT COUNT(DISTINCT ct.SeriesInstanceUID) FROM CT ct
+                WHERE ct.PatientID = s.PatientID AND ct.StudyInstanceUID = s.StudyInstanceUID) as ct_series
         FROM STUDY s
-        LEFT JOIN MR mr ON s.StudyInstanceUID = mr.StudyInstanceUID
-        LEFT JOIN CT ct ON s.StudyInstanceUID = ct.StudyInstanceUID
-        WHERE s.PatientID LIKE '%Hippocampal%'
-        GROUP BY s.StudyInstanceUID, s.PatientID, s.StudyDate, s.StudyDescription
-        HAVING mr_series > 0 AND ct_series > 0
+        WHERE s.PatientID GLOB ?
+        AND EXISTS (SELECT 1 FROM MR mr
+                    WHERE mr.PatientID = s.PatientID AND mr.StudyInstanceUID = s.StudyInstanceUID)
+        AND EXISTS (SELECT 1 FROM CT ct
+                    WHERE ct.PatientID = s.PatientID AND ct.StudyInstanceUID = s.StudyInstanceUID)
         ORDER BY s.StudyDate DESC
         LIMIT 3
-    ''')
-    for row in cursor.fetchall():
-        study_uid = row[0][:30] + '...'
-        desc = row[3][:40] + '...' if len(row[3]) > 40 else row[3]
-        print(f'   {study_uid} | {row[1]} | {row[2]} | {desc} | MR:{row[4]} CT:{row[5]}')
+    ''', (PATIENT_GLOB,))
+    sys.stdout.write(''.join(
+        f'   {row[0]} | {row[1]} | {row[2]} | {row[3]} | MR:{row[4]} CT:{row[5]}\n' for row in cursor
+    ))
 
     print()
 
     # Test 4: Find T1 vs T2 sequence distribution by year
     print('4. T1 vs T2 sequence distribution by year:')
     cursor.execute('''
-        SELECT 
-            SUBSTR(StudyDate, 1, 4) as year,
-            SUM(CASE WHEN (SeriesDescription LIKE '%T1%' OR ProtocolName LIKE '%T1%') THEN 1 ELSE 0 END) as t1_count,
-            SUM(CASE WHEN (SeriesDescription LIKE '%T2%' OR ProtocolName LIKE '%T2%') THEN 1 ELSE 0 END) as t2_count
-        FROM MR
-        WHERE PatientID LIKE '%Hippocampal%'
-        AND StudyDate IS NOT NULL AND StudyDate != ''
-        GROUP BY SUBSTR(StudyDate, 1, 4)
+        SELECT year, SUM(is_t1) as t1_count, SUM(is_t2) as t2_count
+        FROM mr_tags
+        WHERE year != ''
+        GROUP BY year
         ORDER BY year
     ''')
-    for row in cursor.fetchall():
-        print(f'   {row[0]} | T1: {row[1]} series | T2: {row[2]} series')
+    sys.stdout.write(''.join(
+        f'   {row[0]} | T1: {row[1]} series | T2: {row[2]} series\n' for row in cursor
+    ))
 
     print()
 
@@ -96,20 +146,15 @@ def advanced_database_tests():
     print('5. Contrast agent usage patterns:')
     cursor.execute('''
         SELECT 
-            CASE 
-                WHEN (SeriesDescription LIKE '%contrast%' OR SeriesDescription LIKE '%post%' 
-                      OR SeriesDescription LIKE '%Gd%' OR SeriesDescription LIKE '%gadolinium%') 
-                THEN 'With Contrast'
-                ELSE 'No Contrast'
-            END as contrast_status,
+            CASE WHEN is_contrast THEN 'With Contrast' ELSE 'No Contrast' END as contrast_status,
             COUNT(*) as series_count
-        FROM MR
-        WHERE PatientID LIKE '%Hippocampal%'
-        AND (SeriesDescription LIKE '%T1%' OR ProtocolName LIKE '%T1%')
+        FROM mr_tags
+        WHERE is_t1
         GROUP BY contrast_status
     ''')
-    for row in cursor.fetchall():
-        print(f'   {row[0]}: {row[1]} T1 series')
+    sys.stdout.write(''.join(
+        f'   {row[0]}: {row[1]} T1 series\n' for row in cursor
+    ))
 
     print()
 
@@ -122,14 +167,15 @@ def advanced_database_tests():
             MIN(NumberOfSlices) as min_slices,
             MAX(NumberOfSlices) as max_slices
         FROM MR
-        WHERE PatientID LIKE '%Hippocampal%'
+        WHERE PatientID GLOB ?
         AND SliceThickness IS NOT NULL AND SliceThickness != ''
         GROUP BY SliceThickness
         ORDER BY CAST(SliceThickness AS REAL)
         LIMIT 5
-    ''')
-    for row in cursor.fetchall():
-        print(f'   {row[0]}mm thickness | {row[1]} series | {row[2]}-{row[3]} slices')
+    ''', (PATIENT_GLOB,))
+    sys.stdout.write(''.join(
+        f'   {row[0]}mm thickness | {row[1]} series | {row[2]}-{row[3]} slices\n' for row in cursor
+    ))
 
     print()
 
@@ -142,73 +188,86 @@ def advanced_database_tests():
                MAX(StudyDate) as last_study,
                COUNT(*) as total_mr_series
         FROM MR
-        WHERE PatientID LIKE '%Hippocampal%'
+        WHERE PatientID GLOB ?
         GROUP BY PatientID
         HAVING COUNT(DISTINCT StudyDate) > 1
         ORDER BY study_dates DESC
         LIMIT 3
-    ''')
-    for row in cursor.fetchall():
-        print(f'   {row[0]} | {row[1]} time points | {row[2]} to {row[3]} | {row[4]} MR series')
+    ''', (PATIENT_GLOB,))
+    sys.stdout.write(''.join(
+        f'   {row[0]} | {row[1]} time points | {row[2]} to {row[3]} | {row[4]} MR series\n' for row in cursor
+    ))
 
     print()
 
     # Test 8: Search for specific anatomical regions
+    # Each UNION branch is planned on its own, so the BodyPartExamined branch
+    # can seek idx_mr_bodypart; selecting SeriesInstanceUID keeps UNION from
+    # merging distinct series that happen to share the printed columns
     print('8. Find brain-specific sequences:')
     cursor.execute('''
-        SELECT PatientID, StudyDate, SeriesDescription, BodyPartExamined
-        FROM MR
-        WHERE PatientID LIKE '%Hippocampal%'
-        AND (SeriesDescription LIKE '%brain%' 
-             OR SeriesDescription LIKE '%head%'
-             OR SeriesDescription LIKE '%axial%'
-             OR BodyPartExamined LIKE '%BRAIN%')
+        SELECT PatientID, StudyDate,
+               substr(SeriesDescription, 1, 50) || CASE WHEN length(SeriesDescription) > 50 THEN '...' ELSE '' END,
+               BodyPartExamined
+        FROM (
+            SELECT SeriesInstanceUID, PatientID, StudyDate, SeriesDescription, BodyPartExamined
+            FROM MR WHERE BodyPartExamined = 'BRAIN' AND PatientID GLOB :patient
+            UNION
+            SELECT SeriesInstanceUID, PatientID, StudyDate, SeriesDescription, BodyPartExamined
+            FROM MR WHERE PatientID GLOB :patient AND SeriesDescription LIKE '%brain%'
+            UNION
+            SELECT SeriesInstanceUID, PatientID, StudyDate, SeriesDescription, BodyPartExamined
+            FROM MR WHERE PatientID GLOB :patient AND SeriesDescription LIKE '%head%'
+            UNION
+            SELECT SeriesInstanceUID, PatientID, StudyDate, SeriesDescription, BodyPartExamined
+            FROM MR WHERE PatientID GLOB :patient AND SeriesDescription LIKE '%axial%'
+        )
         ORDER BY StudyDate DESC
         LIMIT 5
-    ''')
-    for row in cursor.fetchall():
-        desc = row[2][:50] + '...' if len(row[2]) > 50 else row[2]
-        body_part = row[3] if row[3] else 'N/A'
-        print(f'   {row[0]} | {row[1]} | {desc} | {body_part}')
+    ''', {'patient': PATIENT_GLOB})
+    sys.stdout.write(''.join(
+        f"   {row[0]} | {row[1]} | {row[2]} | {row[3] or 'N/A'}\n" for row in cursor
+    ))
 
     print()
 
     # Test 9: Find patients with treatment planning data
     print('9. Patients with RT planning data:')
     cursor.execute('''
-        SELECT DISTINCT p.PatientID, p.PatientSex,
+        WITH hippo AS (
+            SELECT PatientID, PatientSex FROM PATIENT WHERE PatientID GLOB ?
+        )
+        SELECT h.PatientID, h.PatientSex,
                COUNT(DISTINCT rt.SOPInstanceUID) as rt_plans
-        FROM PATIENT p
-        JOIN RTPLANDB rt ON p.PatientID = rt.PatientID
-        WHERE p.PatientID LIKE '%Hippocampal%'
-        GROUP BY p.PatientID, p.PatientSex
+        FROM hippo h
+        JOIN RTPLANDB rt ON rt.PatientID = h.PatientID
+        GROUP BY h.PatientID, h.PatientSex
         ORDER BY rt_plans DESC
         LIMIT 5
-    ''')
-    for row in cursor.fetchall():
-        print(f'   {row[0]} | {row[1]} | {row[2]} RT plans')
+    ''', (PATIENT_GLOB,))
+    sys.stdout.write(''.join(
+        f'   {row[0]} | {row[1]} | {row[2]} RT plans\n' for row in cursor
+    ))
 
     print()
 
     # Test 10: Advanced sequence pattern matching
     print('10. Advanced sequence pattern detection:')
     sequences = {
-        'T1 MPRAGE': "SeriesDescription LIKE '%MPRAGE%'",
-        'T1 FSPGR': "SeriesDescription LIKE '%FSPGR%'", 
-        'T1 TFL3D': "SequenceName LIKE '%tfl3d%'",
-        'T2 TSE': "SequenceName LIKE '%tse%' OR SeriesDescription LIKE '%TSE%'",
-        'FIESTA': "SeriesDescription LIKE '%FIESTA%'"
+        'T1 MPRAGE': 'is_mprage',
+        'T1 FSPGR': 'is_fspgr',
+        'T1 TFL3D': 'is_tfl3d',
+        'T2 TSE': 'is_tse',
+        'FIESTA': 'is_fiesta'
     }
     
-    for seq_name, condition in sequences.items():
-        cursor.execute(f'''
-            SELECT COUNT(*) 
-            FROM MR 
-            WHERE PatientID LIKE '%Hippocampal%' 
-            AND ({condition})
-        ''')
-        count = cursor.fetchone()[0]
-        print(f'   {seq_name}: {count} series found')
+    # One pass over mr_tags with a SUM column per pattern flag; COALESCE
+    # covers a patient set with no MR rows, where SUM returns NULL
+    counts = ', '.join(f'COALESCE(SUM({flag}), 0)' for flag in sequences.values())
+    cursor.execute(f'SELECT {counts} FROM mr_tags')
+    sys.stdout.write(''.join(
+        f'   {seq_name}: {count} series found\n' for seq_name, count in zip(sequences, cursor.fetchone())
+    ))
 
     conn.close()
     print('\n✅ Advanced database queries completed successfully!')
@@ -13,20 +13,40 @@ class Config:
     def __init__(self):
         self.config_dir = Path.home() / ".vista3d"
         self.config_file = self.config_dir / "config.json"
-        self.config_dir.mkdir(exist_ok=True)
+        self.config_dir.mkdir(mode=0o700, exist_ok=True)
+        self._cache = None
+        
+    def _load(self) -> Dict:
+        """Return the parsed config file, reading it at most once per instance"""
+        if self._cache is None:
+            self._cache = {}
+            if self.config_file.exists():
+                try:
+                    self._cache = json.loads(self.config_file.read_text())
+                except (OSError, ValueError):
+                    pass
+        return self._cache
+    
+    def _save(self, config: Dict):
+        """Atomically replace the config file and refresh the cache"""
+        tmp_file = self.config_file.with_suffix(".tmp")
+        # Created with the permissions of the file being replaced (600 once a
+        # key is stored), or 600 for a new file, so the key is never readable
+        # by others, not even before the rename
+        mode = self.config_file.stat().st_mode & 0o777 if self.config_file.exists() else 0o600
+        tmp_file.unlink(missing_ok=True)  # A leftover would keep its old mode
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps(config, indent=2))
+        os.replace(tmp_file, self.config_file)
+        self._cache = config
         
     def get_openai_key(self) -> Optional[str]:
         """Get OpenAI API key from config file or environment"""
         # First check config file
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-                    key = config.get("openai_api_key")
-                    if key:
-                        return key
-            except:
-                pass
+        key = self._load().get("openai_api_key")
+        if key:
+            return key
         
         # Then check environment variable
         key = os.getenv("OPENAI_API_KEY")
@@ -37,46 +57,25 @@ class Config:
     
     def get_base_paths(self) -> Dict[str, str]:
         """Get base paths from config file"""
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-                    base_paths = config.get("base_paths", {})
-                    if base_paths:
-                        return base_paths
-            except:
-                pass
+        base_paths = self._load().get("base_paths", {})
+        if base_paths:
+            return base_paths
         
         raise ValueError("No base_paths found in config file. Please run: python config.py set-paths")
     
     def get_database_path(self) -> str:
         """Get database path from config file"""
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-                    db_path = config.get("database_path")
-                    if db_path:
-                        return db_path
-            except:
-                pass
+        db_path = self._load().get("database_path")
+        if db_path:
+            return db_path
         
         raise ValueError("No database_path found in config file. Please run: python config.py set-db-path")
     
     def set_openai_key(self, key: str):
         """Save OpenAI API key to config file"""
-        config = {}
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-            except:
-                pass
-        
+        config = dict(self._load())
         config["openai_api_key"] = key
-        
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f, indent=2)
+        self._save(config)
         
         # Set secure permissions
         os.chmod(self.config_file, 0o600)
@@ -85,46 +84,23 @@ class Config:
         """Remove OpenAI API key from config"""
         if self.config_file.exists():
             try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-                
-                if "openai_api_key" in config:
-                    del config["openai_api_key"]
-                    
-                with open(self.config_file, 'w') as f:
-                    json.dump(config, f, indent=2)
-            except:
+                config = dict(self._load())
+                config.pop("openai_api_key", None)
+                self._save(config)
+            except OSError:
                 pass
     
     def set_database_path(self, path: str):
         """Save database path to config file"""
-        config = {}
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-            except:
-                pass
-        
+        config = dict(self._load())
         config["database_path"] = path
-        
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f, indent=2)
+        self._save(config)
     
     def set_base_paths(self, paths: Dict[str, str]):
         """Save base paths to config file"""
-        config = {}
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-            except:
-                pass
-        
+        config = dict(self._load())
         config["base_paths"] = paths
-        
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f, indent=2)
+        self._save(config)
 
 def main():
     """CLI for managing configuration"""
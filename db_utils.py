@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+SQLite helpers for RTPlanDB
+Connections with the shared PRAGMA tuning, plus the indexes and display
+helper used by the database scripts
+"""
+
+import sqlite3
+from pathlib import Path
+
+# The 256 MB page cache and mmap window keep indexes hot across back-to-back
+# analytical queries, and temp_store keeps transient sort/group tables off disk
+_READ_PRAGMAS = """
+PRAGMA busy_timeout=5000;
+PRAGMA cache_size=-262144;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+"""
+
+def truncate(s, n, na=''):
+    """Shorten s to n characters plus '...' for display; na stands in for empty values"""
+    if not s:
+        return na
+    return s if len(s) <= n else s[:n] + '...'
+
+def open_connection(db_path: str, read_only: bool = False) -> sqlite3.Connection:
+    """Open a connection to db_path with the shared PRAGMA settings"""
+    # Only per-connection PRAGMAs are applied. The database belongs to
+    # ARTDaemon, so its journal mode and other persistent settings are left
+    # alone (WAL is also unsupported on the /mnt/c share it lives on)
+    # A larger statement cache keeps every bound-parameter query the scripts
+    # issue prepared for the life of the connection
+    if read_only:
+        # mode=ro opens the file read-only, so SQLite never takes write locks
+        uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, cached_statements=256)
+    else:
+        conn = sqlite3.connect(db_path, cached_statements=256)
+    conn.executescript(_READ_PRAGMAS)
+    return conn
+
+def ensure_indexes(cursor: sqlite3.Cursor):
+    """Create the indexes the RTPlanDB test scripts query through"""
+    # One set for both scripts, so each index is declared once and ARTDaemon's
+    # inserts maintain no duplicates. PatientID leads every MR index, so the
+    # composites also serve plain PatientID lookups. idx_mr_pid_studydate
+    # carries Test 2's columns in ORDER BY order and makes the older
+    # idx_mr_pid_date (PatientID, StudyDate), a prefix of it, redundant
+    cursor.executescript('''
+        DROP INDEX IF EXISTS idx_mr_pid_date;
+        CREATE INDEX IF NOT EXISTS idx_patient_id ON PATIENT(PatientID);
+        CREATE INDEX IF NOT EXISTS idx_mr_pid_studydate
+            ON MR(PatientID, StudyDate, SeriesDate, SeriesInstanceUID, SeriesDescription, SequenceName);
+        CREATE INDEX IF NOT EXISTS idx_mr_pid_thickness ON MR(PatientID, SliceThickness, NumberOfSlices);
+        CREATE INDEX IF NOT EXISTS idx_mr_pid_manuf ON MR(PatientID, Manufacturer, SeriesDescription);
+        CREATE INDEX IF NOT EXISTS idx_mr_bodypart ON MR(BodyPartExamined, PatientID);
+        CREATE INDEX IF NOT EXISTS idx_ct_patient ON CT(PatientID);
+        CREATE INDEX IF NOT EXISTS idx_study_patient ON STUDY(PatientID);
+        CREATE INDEX IF NOT EXISTS idx_rtplandb_patient ON RTPLANDB(PatientID);
+    ''')
@@ -5,12 +5,16 @@ Connects to the actual RTPlanDB.sqlite database and generates a complete schema
 Uses config.py for database path configuration
 """
 
-import sqlite3
-import json
 import os
 import sys
+from collections import defaultdict
 from datetime import datetime
 from config import Config
+from db_utils import open_connection
+import json_utils
+
+# SQLite's default limit on the SELECTs joined in one compound statement
+MAX_COMPOUND_SELECT = 500
 
 class RTPlanDBSchemaGenerator:
     def __init__(self, db_path=None):
@@ -28,16 +32,30 @@ class RTPlanDBSchemaGenerator:
                 print("Please run: python config.py set-db-path <path_to_database>")
                 sys.exit(1)
     
+    def _sample_rows(self, cursor, table, columns):
+        """Fetch the first 3 rows of table to understand data types"""
+        # Truncated in SQL so large values never reach Python whole
+        col_exprs = ", ".join(
+            f'substr(CAST("{col[1]}" AS TEXT), 1, 100)' for col in columns
+        )
+        cursor.execute(f'SELECT {col_exprs} FROM "{table}" LIMIT 3')
+        return cursor.fetchall()
+    
     def analyze_database(self):
         """Connect to database and analyze complete structure"""
         try:
             print(f"Connecting to database: {self.db_path}")
-            conn = sqlite3.connect(self.db_path)
+            conn = open_connection(self.db_path, read_only=True)
             cursor = conn.cursor()
+            cursor.arraysize = 1000
+            
+            # Run the catalog queries inside one read transaction so they share
+            # a single snapshot instead of each opening its own
+            conn.execute("BEGIN")
             
             # Get all tables
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-            tables = [row[0] for row in cursor.fetchall()]
+            tables = [row[0] for row in cursor]
             
             if not tables:
                 print("Warning: No tables found in database")
@@ -55,28 +73,56 @@ class RTPlanDBSchemaGenerator:
             
             print(f"Analyzing {len(tables)} tables...")
             
+            # Fetch structure for every table at once through the pragma
+            # table-valued functions instead of three PRAGMAs per table
+            table_columns = defaultdict(list)
+            cursor.execute("""
+                SELECT m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+                FROM sqlite_master m, pragma_table_info(m.name) p
+                WHERE m.type='table'
+                ORDER BY m.name, p.cid
+            """)
+            for row in cursor:
+                table_columns[row[0]].append(row[1:])
+            
+            table_indexes = defaultdict(list)
+            cursor.execute("""
+                SELECT m.name, p.seq, p.name, p."unique", p.origin, p.partial
+                FROM sqlite_master m, pragma_index_list(m.name) p
+                WHERE m.type='table'
+            """)
+            for row in cursor:
+                table_indexes[row[0]].append(row[1:])
+            
+            table_foreign_keys = defaultdict(list)
+            cursor.execute("""
+                SELECT m.name, p.id, p.seq, p."table", p."from", p."to", p.on_update, p.on_delete, p."match"
+                FROM sqlite_master m, pragma_foreign_key_list(m.name) p
+                WHERE m.type='table'
+            """)
+            for row in cursor:
+                table_foreign_keys[row[0]].append(row[1:])
+            
+            # Row counts for all tables from one UNION ALL query (per
+            # MAX_COMPOUND_SELECT tables), inside the same snapshot
+            row_counts = {}
+            for start in range(0, len(tables), MAX_COMPOUND_SELECT):
+                cursor.execute(" UNION ALL ".join(
+                    f'SELECT {i}, COUNT(*) FROM "{tables[i]}"'
+                    for i in range(start, min(start + MAX_COMPOUND_SELECT, len(tables)))
+                ))
+                for i, count in cursor:
+                    row_counts[tables[i]] = count
+            
             for table in tables:
                 print(f"  Analyzing table: {table}")
                 
-                # Get table structure
-                cursor.execute(f"PRAGMA table_info({table})")
-                columns = cursor.fetchall()
-                
-                # Get row count
-                cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                row_count = cursor.fetchone()[0]
-                
-                # Get sample data from first 3 rows to understand data types
-                cursor.execute(f"SELECT * FROM {table} LIMIT 3")
-                sample_data = cursor.fetchall()
-                
-                # Get indexes
-                cursor.execute(f"PRAGMA index_list({table})")
-                indexes = cursor.fetchall()
+                row_count = row_counts[table]
+                sample_data = self._sample_rows(cursor, table, table_columns[table])
                 
-                # Get foreign key info
-                cursor.execute(f"PRAGMA foreign_key_list({table})")
-                foreign_keys = cursor.fetchall()
+                columns = table_columns[table]
+                indexes = table_indexes[table]
+                foreign_keys = table_foreign_keys[table]
                 
                 # Build column info with actual data examples
                 column_info = {}
@@ -91,7 +137,7 @@ class RTPlanDBSchemaGenerator:
                     sample_values = []
                     for row in sample_data:
                         if i < len(row) and row[i] is not None:
-                            sample_values.append(str(row[i])[:100])  # Limit length
+                            sample_values.append(row[i])
                     
                     column_info[col_name] = {
                         "type": col_type,
@@ -130,6 +176,7 @@ class RTPlanDBSchemaGenerator:
                 
                 print(f"    Rows: {row_count:,}, Columns: {len(columns)}")
             
+            conn.commit()
             conn.close()
             return schema
             
@@ -149,8 +196,8 @@ class RTPlanDBSchemaGenerator:
         
         # Write JSON file
         output_file = "rtplandb_schema.json"
-        with open(output_file, 'w') as f:
-            json.dump(schema, f, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(json_utils.dumps(schema, indent=True))
         
         print(f"\n✅ Schema generated: {output_file}")
         
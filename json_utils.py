@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+JSON helpers for the MCP transport
+Uses orjson when it is installed and falls back to the standard library json
+"""
+
+import json
+import mmap
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers can keep
+# catching json.JSONDecodeError whichever backend is active
+JSONDecodeError = json.JSONDecodeError
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """Serialize obj to UTF-8 JSON bytes, optionally indented by two spaces"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode("utf-8")
+
+def loads(data):
+    """Parse JSON from str or bytes"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def load_file(path):
+    """Parse a JSON file, mapping it into memory instead of reading a copy when orjson is available"""
+    with open(path, "rb") as f:
+        if orjson:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                pass  # Empty file; cannot be mapped, so parse it the usual way
+            else:
+                with mapped, memoryview(mapped) as view:
+                    return orjson.loads(view)
+        return loads(f.read())
@@ -4,13 +4,24 @@ Simple MCP (Model Context Protocol) Client
 Communicates with MCP servers via JSON-RPC over stdio
 """
 
+import io
 import json
+import logging
+import os
 import subprocess
 import sys
-import time
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
+import json_utils
+
+log = logging.getLogger(__name__)
 
 class MCPClient:
+    # Pre-serialized requests whose only varying field is the id
+    _INIT_TEMPLATE = (b'{"jsonrpc": "2.0", "method": "initialize", "id": %d, "params": '
+                      b'{"protocolVersion": "2024-11-05", "capabilities": {}, '
+                      b'"clientInfo": {"name": "simple-mcp-client", "version": "1.0.0"}}}\n')
+    _LIST_TEMPLATE = b'{"jsonrpc": "2.0", "method": "tools/list", "id": %d}\n'
+    
     def __init__(self, server_command: List[str]):
         """Initialize MCP client with server command"""
         self.server_command = server_command
@@ -25,9 +36,11 @@ class MCPClient:
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
             bufsize=0
         )
+        # One write() per flushed request instead of one per line
+        self.stdin = io.BufferedWriter(self.process.stdin, buffer_size=65536)
+        self.stdout = io.BufferedReader(self.process.stdout, buffer_size=65536)
         
     def stop_server(self):
         """Stop the MCP server process"""
@@ -37,48 +50,63 @@ class MCPClient:
             
     def send_request(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Send JSON-RPC request to server"""
-        self.request_id += 1
-        request = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "id": self.request_id
-        }
-        if params:
-            request["params"] = params
-            
-        # Send request
-        request_json = json.dumps(request)
-        print(f"→ Sending: {request_json}")
-        self.process.stdin.write(request_json + "\n")
-        self.process.stdin.flush()
+        return self.send_batch([(method, params)])[0]
         
-        # Read response
-        response_line = self.process.stdout.readline()
-        if not response_line:
-            raise Exception("No response from server")
+    def send_batch(self, calls: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """Send (method, params) calls as one JSON-RPC batch and return responses in call order"""
+        requests = []
+        for method, params in calls:
+            self.request_id += 1
+            request = {
+                "jsonrpc": "2.0",
+                "method": method,
+                "id": self.request_id
+            }
+            if params:
+                request["params"] = params
+            requests.append(request)
             
-        response = json.loads(response_line.strip())
-        print(f"← Received: {json.dumps(response, indent=2)}")
+        # Send a lone request as a plain object, several as a batch array
+        request_json = json_utils.dumps(requests[0] if len(requests) == 1 else requests)
+        return self._exchange(request_json + b"\n", [request["id"] for request in requests])
+        
+    def _send_template(self, template: bytes) -> Dict[str, Any]:
+        """Send one of the pre-serialized request templates with a fresh id"""
+        self.request_id += 1
+        return self._exchange(template % self.request_id, [self.request_id])[0]
+        
+    def _exchange(self, payload: bytes, request_ids: List[int]) -> List[Dict[str, Any]]:
+        """Write an encoded request line and read until every id in request_ids is answered"""
+        log.debug("→ Sending: %s", payload.decode("utf-8").rstrip())
+        self.stdin.write(payload)
+        self.stdin.flush()
         
-        if "error" in response:
-            raise Exception(f"Server error: {response['error']}")
+        # Read responses until every request id is answered
+        responses = {}
+        while len(responses) < len(request_ids):
+            response_line = self.stdout.readline()
+            if not response_line:
+                raise Exception("No response from server")
+                
+            received = json_utils.loads(response_line)
+            # Only pay for the pretty-printed copy when someone will see it
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("← Received: %s", json_utils.dumps(received, indent=True).decode("utf-8"))
             
-        return response
+            for response in received if isinstance(received, list) else [received]:
+                if "error" in response:
+                    raise Exception(f"Server error: {response['error']}")
+                responses[response.get("id")] = response
+                
+        return [responses[request_id] for request_id in request_ids]
         
     def initialize(self):
         """Initialize MCP connection"""
-        return self.send_request("initialize", {
-            "protocolVersion": "2024-11-05",
-            "capabilities": {},
-            "clientInfo": {
-                "name": "simple-mcp-client",
-                "version": "1.0.0"
-            }
-        })
+        return self._send_template(self._INIT_TEMPLATE)
         
     def list_tools(self):
         """List available tools"""
-        return self.send_request("tools/list")
+        return self._send_template(self._LIST_TEMPLATE)
         
     def call_tool(self, tool_name: str, arguments: Dict[str, Any]):
         """Call a specific tool"""
@@ -86,6 +114,23 @@ class MCPClient:
             "name": tool_name,
             "arguments": arguments
         })
+        
+    def call_tools(self, tool_calls: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Call several tools in a single JSON-RPC batch"""
+        return self.send_batch([
+            ("tools/call", {"name": tool_name, "arguments": arguments})
+            for tool_name, arguments in tool_calls
+        ])
+
+def print_tool_result(response: Dict[str, Any]):
+    """Print the text content of a tools/call response"""
+    for item in response.get("result", {}).get("content", []):
+        print(item.get("text", ""))
+
+def print_tools(tools: List[Dict[str, Any]]):
+    """Print a numbered list of tools"""
+    for i, tool in enumerate(tools, 1):
+        print(f"{i}. {tool['name']}: {tool['description']}")
 
 def main():
     """Main CLI interface"""
@@ -93,8 +138,13 @@ def main():
         print("Usage:")
         print("  python3 mcp_client.py <server_command> [args...]")
         print("  python3 mcp_client.py python3 vista3d_mcp_server.py --tasks-path /path/to/tasks")
+        print("  Set MCP_DEBUG=1 to log the raw JSON-RPC traffic")
         sys.exit(1)
         
+    logging.basicConfig(
+        level=logging.DEBUG if os.getenv("MCP_DEBUG") else logging.WARNING,
+        format="%(message)s"
+    )
     server_command = sys.argv[1:]
     client = MCPClient(server_command)
     
@@ -110,9 +160,7 @@ def main():
         print("\n=== Available Tools ===")
         tools_response = client.list_tools()
         tools = tools_response.get("result", {}).get("tools", [])
-        
-        for i, tool in enumerate(tools, 1):
-            print(f"{i}. {tool['name']}: {tool['description']}")
+        print_tools(tools)
             
         # Interactive mode
         print("\n=== Interactive Mode ===")
@@ -123,39 +171,59 @@ def main():
         print("  status <task_id> - Check task status")
         print("  quit - Exit")
         
+        def list_command(rest: str):
+            print_tools(client.list_tools().get("result", {}).get("tools", []))
+            
+        def call_command(rest: str):
+            parts = rest.split(None, 1)
+            if len(parts) < 2:
+                print("Usage: call <tool_name> <json_args>")
+                return
+            try:
+                args = json.loads(parts[1])
+            except json.JSONDecodeError:
+                print("Invalid JSON arguments")
+                return
+            print_tool_result(client.call_tool(parts[0], args))
+            
+        def submit_command(rest: str):
+            parts = rest.split()
+            if len(parts) < 5:
+                print("Usage: submit <input_file> <output_dir> <x> <y> <z>")
+                return
+            args = {
+                "input_file": parts[0],
+                "output_directory": parts[1],
+                "point_coordinates": [int(parts[2]), int(parts[3]), int(parts[4])]
+            }
+            print_tool_result(client.call_tool("submit_vista3d_point_task", args))
+            
+        def status_command(rest: str):
+            if not rest:
+                print("Usage: status <task_id>")
+                return
+            print_tool_result(client.call_tool("check_vista3d_task_status", {"task_id": rest}))
+            
+        # Each line is split once; handlers get the untouched remainder
+        commands = {
+            "list": list_command,
+            "call": call_command,
+            "submit": submit_command,
+            "status": status_command
+        }
+        
         while True:
             try:
-                command = input("\n> ").strip()
-                
-                if command == "quit":
+                parts = input("\n> ").split(None, 1)
+                if not parts:
+                    print("Unknown command")
+                    continue
+                if parts[0] == "quit":
                     break
-                elif command == "list":
-                    client.list_tools()
-                elif command.startswith("call "):
-                    parts = command.split(" ", 2)
-                    if len(parts) < 3:
-                        print("Usage: call <tool_name> <json_args>")
-                        continue
-                    tool_name = parts[1]
-                    try:
-                        args = json.loads(parts[2])
-                        client.call_tool(tool_name, args)
-                    except json.JSONDecodeError:
-                        print("Invalid JSON arguments")
-                elif command.startswith("submit "):
-                    parts = command.split()
-                    if len(parts) < 6:
-                        print("Usage: submit <input_file> <output_dir> <x> <y> <z>")
-                        continue
-                    args = {
-                        "input_file": parts[1],
-                        "output_directory": parts[2],
-                        "point_coordinates": [int(parts[3]), int(parts[4]), int(parts[5])]
-                    }
-                    client.call_tool("submit_vista3d_point_task", args)
-                elif command.startswith("status "):
-                    task_id = command.split(" ", 1)[1]
-                    client.call_tool("check_vista3d_task_status", {"task_id": task_id})
+                    
+                handler = commands.get(parts[0])
+                if handler:
+                    handler(parts[1].strip() if len(parts) > 1 else "")
                 else:
                     print("Unknown command")
                     
@@ -4,38 +4,165 @@ Robust MCP Client with OpenAI Integration
 Handles large outputs and provides OpenAI-powered natural language interface
 """
 
+import asyncio
 import json
-import subprocess
+import re
 import sys
 import time
 import os
 import signal
-from typing import Dict, Any, Optional, List
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Tuple
+import httpx
 from openai import OpenAI
-import threading
 import queue
-from io import StringIO
 from config import Config
+import json_utils
+
+try:
+    import h2  # noqa: F401 - httpx only negotiates HTTP/2 when h2 is installed
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+@lru_cache(maxsize=1)
+def _config() -> Config:
+    """Shared Config for the process, so the config file is read once"""
+    return Config()
+
+# JSON object inside a ``` or ```json fence; the closing fence is optional
+# because _complete_json stops reading at the object's final brace
+_FENCE_RE = re.compile(r"```(?:json)?\s*(\{.*\})", re.DOTALL)
+
+# Prompt templates, filled with str.format_map (literal braces are doubled).
+# The system message is byte-identical across calls in a session so the API's
+# prompt cache can reuse it; only the short user messages change.
+_SYSTEM_TEMPLATE = """You are a Vista3D medical imaging assistant with intelligent file discovery.
+
+Available tools:
+{tools_info}
+
+Base path for patients: {base_path}
+
+Respond only with valid JSON."""
+
+_NL_PROMPT_TEMPLATE = """User command: "{command}"
+
+WORKFLOW: For patient commands, start the discovery process:
+1. If user mentions "patient XXXX", use list_available_images with search_directory: "{base_path}/XXXX/"
+2. The workflow will continue automatically after discovery
+
+Return JSON with:
+- "tool_name": tool to call
+- "arguments": arguments with actual base path
+- "explanation": what will be done
+
+If several independent tools should run at once, instead return
+{{"tool_calls": [{{"tool_name": ..., "arguments": ..., "explanation": ...}}, ...]}}"""
+
+_CONT_PROMPT_TEMPLATE = """Original command: "{original_command}"
+
+Last tool result: {result_text}
+
+IMPORTANT: Use the ACTUAL file paths from the result above. 
+- Find the MR series image.nii.gz file from the list
+- Convert Linux paths (/mnt/c/) to Windows paths (C:\\)
+- Use the real discovered paths, not placeholders
+
+Is the workflow complete? If not, what's the next tool to call with the actual discovered file paths?
+
+If complete, return: {{"workflow_complete": true, "explanation": "Task completed"}}
+If not complete, return: {{"tool_name": "actual_tool_name", "arguments": {{...with real paths...}}, "explanation": "Next step"}}"""
+
+# Shared decoder for pulling JSON values out of malformed response lines
+_DECODER = json.JSONDecoder()
+
+def _decode_objects(text: str) -> Tuple[List[Any], str]:
+    """Decode consecutive JSON values from text, returning them and the undecoded rest"""
+    objects = []
+    idx = 0
+    while True:
+        while idx < len(text) and text[idx].isspace():
+            idx += 1
+        if idx == len(text):
+            return objects, ""
+        try:
+            obj, idx = _DECODER.raw_decode(text, idx)
+        except ValueError:
+            return objects, text[idx:]
+        objects.append(obj)
+
+def _compact_result(text: str, max_chars: int = 4096) -> str:
+    """Trim a tool result for the continuation prompt, keeping its head and tail"""
+    if len(text) <= max_chars:
+        return text
+    
+    # Directory listings are "- path" lines; only NIfTI images matter for
+    # choosing the next step
+    lines = text.splitlines()
+    if sum(line.startswith("- ") for line in lines) > len(lines) // 2:
+        text = "\n".join(
+            line for line in lines
+            if not line.startswith("- ") or ".nii" in line
+        )
+        if len(text) <= max_chars:
+            return text
+    
+    half = max_chars // 2
+    return f"{text[:half]}\n...[{len(text) - max_chars} chars truncated]...\n{text[-half:]}"
 
 class RobustMCPClient:
+    # Seconds a tools/list result is reused before asking the server again
+    TOOLS_TTL = 60
+    
+    # Seconds an identical call to a read-only tool is answered from cache;
+    # tools not listed here (task submission) are never cached
+    _TOOL_TTL = {
+        "list_available_images": 30.0,
+        "query_patient_images": 30.0,
+        "check_vista3d_task_status": 2.0
+    }
+    
+    # Pre-serialized requests whose only varying field is the id
+    _INIT_TEMPLATE = (b'{"jsonrpc": "2.0", "method": "initialize", "id": %d, "params": '
+                      b'{"protocolVersion": "2024-11-05", "capabilities": {}, '
+                      b'"clientInfo": {"name": "robust-mcp-client", "version": "1.0.0"}}}\n')
+    _LIST_TEMPLATE = b'{"jsonrpc": "2.0", "method": "tools/list", "id": %d}\n'
+    
+    # Bytes requested from the server's stdout per read
+    _READ_CHUNK = 64 * 1024
+    
     def __init__(self, server_command: List[str], openai_api_key: Optional[str] = None):
         """Initialize robust MCP client with optional OpenAI integration"""
         self.server_command = server_command
         self.process = None
         self.request_id = 0
         self.openai_client = None
-        self.output_queue = queue.Queue()
         self.error_queue = queue.Queue()
+        self._loop = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._partial = ""
+        self._reader_tasks = []
+        self._tools_cache = None
+        self._tools_cache_ts = 0
+        self._tools_info = None
+        self._system_message = None
+        self._call_cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
         
         # Initialize OpenAI - try provided key, then config, then environment
+        config = _config()
         if not openai_api_key:
-            config = Config()
             openai_api_key = config.get_openai_key()
-        else:
-            config = Config()
         
         if openai_api_key:
-            self.openai_client = OpenAI(api_key=openai_api_key)
+            # One pooled client keeps the TLS connection warm between the
+            # command and continuation calls
+            http_client = httpx.Client(
+                http2=_HTTP2,
+                limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60),
+                timeout=httpx.Timeout(30.0, connect=5.0)
+            )
+            self.openai_client = OpenAI(api_key=openai_api_key, http_client=http_client)
             
         # Load base paths from config
         self.base_paths = config.get_base_paths()
@@ -44,260 +171,392 @@ class RobustMCPClient:
         """Start the MCP server process with robust error handling"""
         print(f"Starting MCP server: {' '.join(self.server_command)}")
         try:
-            self.process = subprocess.Popen(
-                self.server_command,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,  # Line buffered
-                preexec_fn=os.setsid if os.name != 'nt' else None  # Process group for cleanup
-            )
+            # A private loop drives the subprocess; the public methods stay
+            # synchronous and run it only while waiting on the server
+            self._loop = asyncio.new_event_loop()
+            self._run(self._start_server())
             
-            # Start background threads to handle output
-            self.stdout_thread = threading.Thread(target=self._read_stdout, daemon=True)
-            self.stderr_thread = threading.Thread(target=self._read_stderr, daemon=True)
-            self.stdout_thread.start()
-            self.stderr_thread.start()
-            
-            time.sleep(1)  # Give server time to start
+            # No startup delay: initialize() waits for the server's first
+            # response, which doubles as the readiness signal
             
         except Exception as e:
             raise Exception(f"Failed to start server: {e}")
     
-    def _read_stdout(self):
-        """Background thread to read stdout without blocking"""
-        try:
-            while self.process and self.process.poll() is None:
-                line = self.process.stdout.readline()
-                if line:
-                    self.output_queue.put(line.strip())
-        except Exception as e:
-            self.error_queue.put(f"Stdout reader error: {e}")
+    def _run(self, coro):
+        """Run a coroutine to completion on the client's event loop"""
+        return self._loop.run_until_complete(coro)
     
-    def _read_stderr(self):
-        """Background thread to read stderr without blocking"""
-        try:
-            while self.process and self.process.poll() is None:
-                line = self.process.stderr.readline()
-                if line:
-                    self.error_queue.put(line.strip())
-        except Exception as e:
-            self.error_queue.put(f"Stderr reader error: {e}")
+    async def _start_server(self):
+        """Spawn the server and start the stdout/stderr reader tasks"""
+        self.process = await asyncio.create_subprocess_exec(
+            *self.server_command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=os.name != 'nt'  # Process group for cleanup
+        )
+        self._reader_tasks = [
+            asyncio.ensure_future(self._read_stdout()),
+            asyncio.ensure_future(self._read_stderr())
+        ]
+    
+    async def _read_stdout(self):
+        """Resolve pending request futures from newline-delimited responses"""
+        # Frames accumulate in one bytearray and are parsed straight from the
+        # bytes, so response size is not bounded by a readline limit
+        buf = bytearray()
+        while True:
+            chunk = await self.process.stdout.read(self._READ_CHUNK)
+            if not chunk:
+                break
+            
+            # Only the new bytes can hold a newline; the leftover never does
+            search = len(buf)
+            buf += chunk
+            begin = 0
+            end = buf.find(b"\n", search)
+            while end != -1:
+                self._dispatch_frame(buf[begin:end])
+                begin = end + 1
+                end = buf.find(b"\n", begin)
+            del buf[:begin]
+        
+        # The server is gone, so nothing still pending can be answered
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(Exception("Server closed its output"))
+        self._pending.clear()
+    
+    def _dispatch_frame(self, frame: bytearray):
+        """Parse one response line and hand each response to its waiting future"""
+        if not frame.strip():
+            return
+        if self._partial:
+            received = self._salvage_frame(frame)
+        else:
+            try:
+                received = [json_utils.loads(frame)]
+            except json.JSONDecodeError:
+                received = self._salvage_frame(frame)
+        
+        for value in received:
+            for response in value if isinstance(value, list) else [value]:
+                if not isinstance(response, dict):
+                    continue
+                future = self._pending.pop(response.get("id"), None)
+                if future and not future.done():
+                    future.set_result(response)
+    
+    def _salvage_frame(self, frame: bytearray) -> List[Any]:
+        """Recover responses from a line holding several objects or part of one"""
+        text = frame.decode("utf-8", errors="replace")
+        
+        # A value split across lines completes when joined with the carried part;
+        # if joining yields nothing, the carried part was noise and is dropped
+        carried, self._partial = self._partial, ""
+        objects, rest = _decode_objects(carried + "\n" + text) if carried else ([], "")
+        if not objects:
+            objects, rest = _decode_objects(text)
+        if rest.startswith(("{", "[")):
+            self._partial = rest
+        return objects
+    
+    async def _read_stderr(self):
+        """Collect server stderr lines into error_queue"""
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                break
+            if line.strip():
+                self.error_queue.put(line.decode("utf-8", errors="replace").strip())
     
     def stop_server(self):
         """Stop the MCP server process gracefully"""
-        if self.process:
+        if self.process and self.process.returncode is None:
             try:
                 if os.name != 'nt':
                     os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
                 else:
                     self.process.terminate()
-                self.process.wait(timeout=5)
+                self._run(asyncio.wait_for(self.process.wait(), 5))
             except:
-                if os.name != 'nt':
-                    os.killpg(os.getpgid(self.process.pid), signal.SIGKILL)
-                else:
-                    self.process.kill()
+                try:
+                    if os.name != 'nt':
+                        os.killpg(os.getpgid(self.process.pid), signal.SIGKILL)
+                    else:
+                        self.process.kill()
+                except ProcessLookupError:
+                    pass  # Exited before it could be killed
+                self._run(self.process.wait())
+        if self._loop:
+            for task in self._reader_tasks:
+                task.cancel()
+            self._run(asyncio.gather(*self._reader_tasks, return_exceptions=True))
+            self._loop.close()
+            self._loop = None
     
     def send_request(self, method: str, params: Optional[Dict[str, Any]] = None, timeout: int = 30) -> Dict[str, Any]:
         """Send JSON-RPC request with timeout and error handling"""
-        if not self.process or self.process.poll() is not None:
-            raise Exception("Server process not running")
+        return self.send_batch([(method, params)], timeout)[0]
+    
+    def send_batch(self, calls: List[Tuple[str, Optional[Dict[str, Any]]]], timeout: int = 30) -> List[Dict[str, Any]]:
+        """Send (method, params) calls as one JSON-RPC batch and return responses in call order"""
+        requests = []
+        for method, params in calls:
+            self.request_id += 1
+            request = {
+                "jsonrpc": "2.0",
+                "method": method,
+                "id": self.request_id
+            }
+            if params:
+                request["params"] = params
+            requests.append(request)
+        methods = {request["id"]: request["method"] for request in requests}
         
+        # Send a lone request as a plain object, several as a batch array
+        request_json = json_utils.dumps(requests[0] if len(requests) == 1 else requests)
+        return self._exchange(request_json + b"\n", methods, timeout)
+    
+    def _send_template(self, template: bytes, method: str, timeout: int = 30) -> Dict[str, Any]:
+        """Send one of the pre-serialized request templates with a fresh id"""
         self.request_id += 1
-        request = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "id": self.request_id
-        }
-        if params:
-            request["params"] = params
+        return self._exchange(template % self.request_id, {self.request_id: method}, timeout)[0]
+    
+    def _exchange(self, payload: bytes, methods: Dict[int, str], timeout: int) -> List[Dict[str, Any]]:
+        """Write an encoded request line and wait for a response to every id in methods"""
+        if not self.process or self.process.returncode is not None:
+            raise Exception("Server process not running")
         
-        # Send request
-        try:
-            request_json = json.dumps(request)
-            print(f"→ Sending: {method}")
-            self.process.stdin.write(request_json + "\n")
-            self.process.stdin.flush()
-        except Exception as e:
-            raise Exception(f"Failed to send request: {e}")
+        responses = self._run(self._exchange_async(payload, methods, timeout))
+        for request_id, response in zip(methods, responses):
+            print(f"← Received: {methods[request_id]} completed")
+            
+            if "error" in response:
+                self._tools_cache = None
+                raise Exception(f"Server error: {response['error']}")
         
-        # Wait for response with timeout
-        start_time = time.time()
-        while time.time() - start_time < timeout:
+        return responses
+    
+    async def _exchange_async(self, payload: bytes, methods: Dict[int, str], timeout: int) -> List[Dict[str, Any]]:
+        """Register a future per request id, send payload and await all of them"""
+        futures = [self._loop.create_future() for _ in methods]
+        self._pending.update(zip(methods, futures))
+        try:
             try:
-                response_line = self.output_queue.get(timeout=1)
-                if response_line.strip():
-                    response = json.loads(response_line)
-                    if response.get("id") == self.request_id:
-                        print(f"← Received: {method} completed")
-                        
-                        if "error" in response:
-                            raise Exception(f"Server error: {response['error']}")
-                        
-                        return response
-            except queue.Empty:
-                continue
-            except json.JSONDecodeError:
-                continue
-        
-        raise Exception(f"Request {method} timed out after {timeout}s")
+                print(f"→ Sending: {', '.join(methods.values())}")
+                self.process.stdin.write(payload)
+                await self.process.stdin.drain()
+            except Exception as e:
+                raise Exception(f"Failed to send request: {e}")
+            
+            try:
+                return await asyncio.wait_for(asyncio.gather(*futures), timeout)
+            except asyncio.TimeoutError:
+                raise Exception(f"Request {', '.join(methods.values())} timed out after {timeout}s")
+        finally:
+            for request_id in methods:
+                self._pending.pop(request_id, None)
     
     def initialize(self):
         """Initialize MCP connection"""
-        return self.send_request("initialize", {
-            "protocolVersion": "2024-11-05",
-            "capabilities": {},
-            "clientInfo": {
-                "name": "robust-mcp-client",
-                "version": "1.0.0"
-            }
-        })
+        self._tools_cache = None
+        return self._send_template(self._INIT_TEMPLATE, "initialize")
     
     def list_tools(self):
         """List available tools"""
-        return self.send_request("tools/list")
+        return self._send_template(self._LIST_TEMPLATE, "tools/list")
+    
+    def _tools_cache_stale(self, margin: float = 0.0) -> bool:
+        """Whether the cached tools/list result is missing or expires within margin seconds"""
+        return self._tools_cache is None or time.time() - self._tools_cache_ts >= self.TOOLS_TTL - margin
+    
+    def _store_tools(self, response: Dict[str, Any]):
+        """Cache a tools/list response along with its prompt-ready summary"""
+        tools = response.get("result", {}).get("tools", [])
+        
+        # Prompt-ready summary of the tools, one signature line per tool and
+        # built once per refresh; far fewer tokens than the indented schemas
+        lines = []
+        for tool in tools:
+            params = tool.get("inputSchema", {}).get("properties", {})
+            signature = ", ".join(f"{name}: {spec.get('type', 'any')}" for name, spec in params.items())
+            lines.append(f"- {tool['name']}({signature}): {tool['description']}")
+        
+        self._tools_info = "\n".join(lines)
+        self._tools_cache = tools
+        self._tools_cache_ts = time.time()
+    
+    def get_tools_cached(self) -> List[Dict[str, Any]]:
+        """List available tools, reusing the last result for TOOLS_TTL seconds"""
+        if self._tools_cache_stale():
+            self._store_tools(self.list_tools())
+        return self._tools_cache
+    
+    def _get_tools_info(self) -> str:
+        """Return the cached prompt summary of the available tools"""
+        self.get_tools_cached()
+        return self._tools_info
+    
+    def _get_system_message(self) -> Dict[str, str]:
+        """Return the shared system message, rebuilt only when the tools summary changes"""
+        tools_info_str = self._get_tools_info()
+        if self._system_message is None or self._system_message[0] is not tools_info_str:
+            self._system_message = (tools_info_str, {
+                "role": "system",
+                "content": _SYSTEM_TEMPLATE.format_map({
+                    "tools_info": tools_info_str,
+                    "base_path": self.base_paths['dcm2nifti_base']
+                })
+            })
+        return self._system_message[1]
     
     def call_tool(self, tool_name: str, arguments: Dict[str, Any]):
-        """Call a specific tool"""
-        return self.send_request("tools/call", {
-            "name": tool_name,
-            "arguments": arguments
-        })
+        """Call a specific tool, reusing a fresh cached result for read-only tools"""
+        ttl = self._TOOL_TTL.get(tool_name, 0.0)
+        if ttl <= 0:
+            return self.send_request("tools/call", {
+                "name": tool_name,
+                "arguments": arguments
+            })
+        
+        key = (tool_name, json.dumps(arguments, sort_keys=True, separators=(",", ":")))
+        cached = self._call_cache.get(key)
+        if cached and time.time() - cached[0] < ttl:
+            return cached[1]
+        
+        try:
+            response = self.send_request("tools/call", {
+                "name": tool_name,
+                "arguments": arguments
+            })
+        except Exception:
+            self._call_cache.pop(key, None)
+            raise
+        self._call_cache[key] = (time.time(), response)
+        return response
+    
+    def call_tools(self, tool_calls: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Call several tools in a single JSON-RPC batch"""
+        return self.send_batch([
+            ("tools/call", {"name": tool_name, "arguments": arguments})
+            for tool_name, arguments in tool_calls
+        ])
+    
+    def _complete_json(self, prompt: str) -> str:
+        """Stream a JSON-mode completion and stop reading once the outer object closes"""
+        stream = self.openai_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[self._get_system_message(), {"role": "user", "content": prompt}],
+            max_tokens=256,
+            temperature=0.1,
+            response_format={"type": "json_object"},
+            stream=True
+        )
+        
+        # Track brace depth outside of string literals so trailing tokens
+        # after the closing brace are never waited for
+        parts = []
+        depth = 0
+        in_string = False
+        escaped = False
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content or ""
+                for i, ch in enumerate(token):
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif ch == "\\":
+                            escaped = True
+                        elif ch == '"':
+                            in_string = False
+                    elif ch == '"':
+                        in_string = True
+                    elif ch == "{":
+                        depth += 1
+                    elif ch == "}":
+                        depth -= 1
+                        if depth == 0:
+                            parts.append(token[:i + 1])
+                            return "".join(parts).strip()
+                parts.append(token)
+        finally:
+            stream.close()
+        return "".join(parts).strip()
     
     def natural_language_command(self, command: str) -> Dict[str, Any]:
         """Process natural language command using OpenAI"""
         if not self.openai_client:
             raise Exception("OpenAI client not initialized")
         
-        # Get available tools
-        tools_response = self.list_tools()
-        tools = tools_response.get("result", {}).get("tools", [])
-        
-        # Create prompt for OpenAI
-        tools_info = []
-        for tool in tools:
-            tools_info.append({
-                "name": tool["name"],
-                "description": tool["description"],
-                "parameters": tool.get("inputSchema", {}).get("properties", {})
-            })
-        
-        
-        prompt = f"""You are a Vista3D medical imaging assistant with intelligent file discovery.
-
-Available tools:
-{json.dumps(tools_info, indent=2)}
-
-User command: "{command}"
-
-Base path for patients: {self.base_paths['dcm2nifti_base']}
-
-WORKFLOW: For patient commands, start the discovery process:
-1. If user mentions "patient XXXX", use list_available_images with search_directory: "{self.base_paths['dcm2nifti_base']}/XXXX/"
-2. The workflow will continue automatically after discovery
-
-Return JSON with:
-- "tool_name": tool to call
-- "arguments": arguments with actual base path
-- "explanation": what will be done
-
-Respond only with valid JSON."""
+        # Create prompt for OpenAI; the tools go in the shared system message
+        prompt = _NL_PROMPT_TEMPLATE.format_map({
+            "command": command,
+            "base_path": self.base_paths['dcm2nifti_base']
+        })
 
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000,
-                temperature=0.1
-            )
-            
-            content = response.choices[0].message.content.strip()
+            content = self._complete_json(prompt)
             print(f"🔍 OpenAI response: {content}")
             
             # Try to extract JSON from the response
-            if content.startswith("```json"):
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif content.startswith("```"):
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            result = json.loads(content)
+            match = _FENCE_RE.search(content)
+            result = json_utils.loads(match.group(1) if match else content)
             
             if "error" in result:
                 return {"error": result["error"], "suggestions": result.get("suggestions", [])}
             
-            # Execute the tool call
-            tool_name = result["tool_name"]
-            arguments = result["arguments"]
-            explanation = result.get("explanation", "")
+            # Execute the tool call(s), batching several into one round-trip
+            tool_calls = result.get("tool_calls") or [result]
+            for tool_call in tool_calls:
+                print(f"🤖 {tool_call.get('explanation', '')}")
             
-            print(f"🤖 {explanation}")
+            requests = [
+                ("tools/call", {"name": tool_call["tool_name"], "arguments": tool_call["arguments"]})
+                for tool_call in tool_calls
+            ]
             
-            # Call the tool
-            tool_result = self.call_tool(tool_name, arguments)
+            # If the tools list is past half its TTL it may expire before the
+            # continuation prompt, so refresh it in the same batch instead of
+            # paying a separate round-trip later
+            refresh_tools = self._tools_cache_stale(margin=self.TOOLS_TTL / 2)
+            if refresh_tools:
+                requests.append(("tools/list", {}))
+            tool_results = self.send_batch(requests)
+            if refresh_tools:
+                self._store_tools(tool_results.pop())
             
             # Check if OpenAI wants to continue with more tool calls
-            return self._continue_workflow_if_needed(command, tool_result)
+            return self._continue_workflow_if_needed(command, tool_results)
             
         except Exception as e:
             return {"error": f"Failed to process command: {str(e)}"}
     
-    def _continue_workflow_if_needed(self, original_command: str, tool_result: Dict[str, Any]) -> Dict[str, Any]:
+    def _continue_workflow_if_needed(self, original_command: str, tool_results: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Continue workflow if OpenAI determines more steps are needed"""
+        tool_result = tool_results[-1]
         try:
             # Ask OpenAI if the workflow is complete or if more steps are needed
-            result_content = tool_result.get("result", {}).get("content", [])
-            result_text = result_content[0].get("text", "") if result_content else ""
-            
-            # Get available tools for the continuation prompt
-            tools_response = self.list_tools()
-            tools = tools_response.get("result", {}).get("tools", [])
-            
-            tools_info = []
-            for tool in tools:
-                tools_info.append({
-                    "name": tool["name"],
-                    "description": tool["description"],
-                    "parameters": tool.get("inputSchema", {}).get("properties", {})
-                })
+            result_texts = []
+            for result in tool_results:
+                result_content = result.get("result", {}).get("content", [])
+                result_texts.append(result_content[0].get("text", "") if result_content else "")
+            result_text = "\n\n".join(result_texts)
             
-            continuation_prompt = f"""Original command: "{original_command}"
-
-Available tools:
-{json.dumps(tools_info, indent=2)}
-
-Last tool result: {result_text}
-
-IMPORTANT: Use the ACTUAL file paths from the result above. 
-- Find the MR series image.nii.gz file from the list
-- Convert Linux paths (/mnt/c/) to Windows paths (C:\\)
-- Use the real discovered paths, not placeholders
-
-Is the workflow complete? If not, what's the next tool to call with the actual discovered file paths?
-
-If complete, return: {{"workflow_complete": true, "explanation": "Task completed"}}
-If not complete, return: {{"tool_name": "actual_tool_name", "arguments": {{...with real paths...}}, "explanation": "Next step"}}
-
-Respond only with valid JSON."""
+            continuation_prompt = _CONT_PROMPT_TEMPLATE.format_map({
+                "original_command": original_command,
+                "result_text": _compact_result(result_text)
+            })
 
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": continuation_prompt}],
-                max_tokens=1000,
-                temperature=0.1
-            )
-            
-            content = response.choices[0].message.content.strip()
+            content = self._complete_json(continuation_prompt)
             print(f"🔍 OpenAI workflow check: {content}")
             
             # Parse the response
-            if content.startswith("```json"):
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif content.startswith("```"):
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            result = json.loads(content)
+            match = _FENCE_RE.search(content)
+            result = json_utils.loads(match.group(1) if match else content)
             
             # If workflow is complete, return the original result
             if result.get("workflow_complete"):
@@ -353,8 +612,7 @@ def main():
     server_command = sys.argv[1:]
     
     # Try to get OpenAI API key automatically
-    config = Config()
-    openai_api_key = config.get_openai_key()
+    openai_api_key = _config().get_openai_key()
     
     client = RobustMCPClient(server_command, openai_api_key)
     
@@ -368,8 +626,7 @@ def main():
         
         # List available tools
         print("📋 Loading available tools...")
-        tools_response = client.list_tools()
-        tools = tools_response.get("result", {}).get("tools", [])
+        tools = client.get_tools_cached()
         
         print(f"✅ Connected! {len(tools)} tools available.")
         
@@ -384,48 +641,64 @@ def main():
         print("  Natural language: 'segment liver from test.nii.gz'")
         print("  quit - Exit")
         
+        def help_command():
+            print("Available commands:")
+            print("  tools - List available tools")
+            print("  call <tool_name> <json_args> - Direct tool call")
+            if openai_api_key:
+                print("  Natural language commands (e.g., 'segment liver from test.nii.gz')")
+        
+        def tools_command():
+            for i, tool in enumerate(tools, 1):
+                print(f"{i}. {tool['name']}: {tool['description']}")
+        
+        def call_command(rest: str):
+            parts = rest.split(None, 1)
+            if len(parts) < 2:
+                print("Usage: call <tool_name> <json_args>")
+                return
+            try:
+                args = json.loads(parts[1])
+                result = client.call_tool(parts[0], args)
+                print(f"✅ Tool completed: {result}")
+            except json.JSONDecodeError:
+                print("❌ Invalid JSON arguments")
+            except Exception as e:
+                print(f"❌ Tool failed: {e}")
+        
+        def natural_language(command: str):
+            result = client.natural_language_command(command)
+            if "error" in result:
+                print(f"❌ {result['error']}")
+                if "suggestions" in result:
+                    print("💡 Suggestions:")
+                    for suggestion in result["suggestions"]:
+                        print(f"  - {suggestion}")
+            else:
+                print(f"✅ {result.get('explanation', 'Command completed')}")
+                if "tool_result" in result:
+                    print(f"📊 Result: {result['tool_result']}")
+        
+        # Whole-line commands; anything else, such as "help me segment the
+        # liver", goes to the natural language path
+        commands = {
+            "help": help_command,
+            "tools": tools_command
+        }
+        
         while True:
             try:
                 command = input("\n> ").strip()
                 
                 if command == "quit":
                     break
-                elif command == "help":
-                    print("Available commands:")
-                    print("  tools - List available tools")
-                    print("  call <tool_name> <json_args> - Direct tool call")
-                    if openai_api_key:
-                        print("  Natural language commands (e.g., 'segment liver from test.nii.gz')")
-                elif command == "tools":
-                    for i, tool in enumerate(tools, 1):
-                        print(f"{i}. {tool['name']}: {tool['description']}")
+                elif command in commands:
+                    commands[command]()
                 elif command.startswith("call "):
-                    parts = command.split(" ", 2)
-                    if len(parts) < 3:
-                        print("Usage: call <tool_name> <json_args>")
-                        continue
-                    tool_name = parts[1]
-                    try:
-                        args = json.loads(parts[2])
-                        result = client.call_tool(tool_name, args)
-                        print(f"✅ Tool completed: {result}")
-                    except json.JSONDecodeError:
-                        print("❌ Invalid JSON arguments")
-                    except Exception as e:
-                        print(f"❌ Tool failed: {e}")
+                    call_command(command[len("call "):])
                 elif command and openai_api_key:
                     # Try natural language processing
-                    result = client.natural_language_command(command)
-                    if "error" in result:
-                        print(f"❌ {result['error']}")
-                        if "suggestions" in result:
-                            print("💡 Suggestions:")
-                            for suggestion in result["suggestions"]:
-                                print(f"  - {suggestion}")
-                    else:
-                        print(f"✅ {result.get('explanation', 'Command completed')}")
-                        if "tool_result" in result:
-                            print(f"📊 Result: {result['tool_result']}")
+                    natural_language(command)
                 else:
                     print("❌ Unknown command or OpenAI not configured")
                     
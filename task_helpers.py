@@ -6,11 +6,16 @@ Helper functions for creating and submitting tasks to the ARTDaemon system.
 These functions can be used with MCP tools to automate task creation.
 """
 
-import json
 import time
 import os
-from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional
+import json_utils
+
+# Parallel file writers used by submit_tasks
+WRITER_WORKERS = 8
 
 # Base path for tasks - can be overridden
 def get_tasks_base_path() -> str:
@@ -19,7 +24,7 @@ def get_tasks_base_path() -> str:
 
 def generate_task_id(prefix: str = "task") -> str:
     """Generate a unique task ID with timestamp."""
-    timestamp = int(time.time() * 1000)  # milliseconds
+    timestamp = time.time_ns()  # nanoseconds, so burst submits don't collide
     return f"{prefix}_{timestamp}"
 
 def create_vista3d_point_task(
@@ -153,6 +158,13 @@ def create_segman_task(
     
     return task
 
+@lru_cache(maxsize=16)
+def _task_folder(base_path: str, task_folder: str) -> str:
+    """Join and create a task folder, once per (base, folder) pair."""
+    folder_path = os.path.join(base_path, task_folder)
+    os.makedirs(folder_path, exist_ok=True)
+    return folder_path
+
 def submit_task(task: Dict, task_folder: str, filename: Optional[str] = None, tasks_base_path: Optional[str] = None) -> str:
     """
     Submit a task by writing JSON file to the appropriate folder.
@@ -177,15 +189,58 @@ def submit_task(task: Dict, task_folder: str, filename: Optional[str] = None, ta
         filename += '.json'
     
     base_path = tasks_base_path or get_tasks_base_path()
-    folder_path = Path(base_path) / task_folder
-    folder_path.mkdir(parents=True, exist_ok=True)
+    folder_path = _task_folder(base_path, task_folder)
+    task_file_path = os.path.join(folder_path, filename)
+    
+    # Write the whole file under a temporary name and rename it into place so
+    # the daemon never picks up a partially written task. The name is unique
+    # to this process and thread, so submit_tasks workers given the same task
+    # never write into one file; O_TRUNC overwrites one left by a crash
+    data = json_utils.dumps(task, indent=True)
+    tmp_path = f"{task_file_path[:-len('.json')]}.{os.getpid()}.{threading.get_ident()}.tmp"
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    try:
+        fd = os.open(tmp_path, flags, 0o644)
+    except FileNotFoundError:
+        # The folder was removed after it was cached; create it again
+        _task_folder.cache_clear()
+        _task_folder(base_path, task_folder)
+        fd = os.open(tmp_path, flags, 0o644)
+    try:
+        try:
+            # os.write may write less than asked; repeat until all is down
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, task_file_path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+    
+    return task_file_path
+
+def submit_tasks(tasks: List[Dict], task_folder: str, tasks_base_path: Optional[str] = None) -> List[str]:
+    """
+    Submit several tasks to one folder, writing the files in parallel.
     
-    task_file_path = folder_path / filename
+    Args:
+        tasks: Task dictionaries
+        task_folder: Folder name under tasks base path
+        tasks_base_path: Base path for tasks (uses default if None)
     
-    with open(task_file_path, 'w') as f:
-        json.dump(task, f, indent=2)
+    Returns:
+        Paths to the created task files, in the order of tasks
+    """
+    base_path = tasks_base_path or get_tasks_base_path()
     
-    return str(task_file_path)
+    # Each file is independent and the GIL is released during the write
+    # syscalls, so a small pool overlaps them
+    with ThreadPoolExecutor(max_workers=WRITER_WORKERS) as executor:
+        return list(executor.map(
+            lambda task: submit_task(task, task_folder, tasks_base_path=base_path), tasks
+        ))
 
 def submit_vista3d_task(
     input_file: str,
@@ -241,6 +296,21 @@ def submit_sam_task(
     
     return submit_task(task, "SAM", tasks_base_path=tasks_base_path)
 
+def _scan_names(folder: str, *names: str) -> set:
+    """Return which of names are files in folder, listing it at most once."""
+    wanted = set(names)
+    found = set()
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name in wanted and entry.is_file():
+                    found.add(entry.name)
+                    if found == wanted:
+                        break
+    except OSError:
+        pass
+    return found
+
 def check_task_status(task_id: str, task_folder: str, tasks_base_path: Optional[str] = None) -> Dict:
     """
     Check the status of a submitted task.
@@ -254,31 +324,29 @@ def check_task_status(task_id: str, task_folder: str, tasks_base_path: Optional[
         Dictionary with status information
     """
     base_path = tasks_base_path or get_tasks_base_path()
-    folder_path = Path(base_path) / task_folder
+    folder_path = os.path.join(base_path, task_folder)
+    target = f"{task_id}.json"
+    result_target = f"{task_id}_result.json"
     
     # Check if task is still in queue
-    pending_file = folder_path / f"{task_id}.json"
-    if pending_file.exists():
-        return {"status": "pending", "file": str(pending_file)}
-    
-    # Check if task is processed
-    processed_folder = folder_path / "processed"
-    processed_file = processed_folder / f"{task_id}.json"
-    result_file = processed_folder / f"{task_id}_result.json"
-    
-    if processed_file.exists():
-        status = {"status": "processed", "file": str(processed_file)}
-        if result_file.exists():
-            with open(result_file, 'r') as f:
-                status["result"] = json.load(f)
+    if target in _scan_names(folder_path, target):
+        return {"status": "pending", "file": os.path.join(folder_path, target)}
+    
+    # Check if task is processed; one listing answers both the task and
+    # result file lookups
+    processed_folder = os.path.join(folder_path, "processed")
+    found = _scan_names(processed_folder, target, result_target)
+    
+    if target in found:
+        status = {"status": "processed", "file": os.path.join(processed_folder, target)}
+        if result_target in found:
+            status["result"] = json_utils.load_file(os.path.join(processed_folder, result_target))
         return status
     
     # Check if task failed
-    failed_folder = folder_path / "failed"
-    failed_file = failed_folder / f"{task_id}.json"
-    
-    if failed_file.exists():
-        return {"status": "failed", "file": str(failed_file)}
+    failed_folder = os.path.join(folder_path, "failed")
+    if target in _scan_names(failed_folder, target):
+        return {"status": "failed", "file": os.path.join(failed_folder, target)}
     
     return {"status": "not_found"}
 
@@ -335,6 +403,7 @@ if __name__ == "__main__":
     print("Available functions:")
     print("- submit_vista3d_task(): Point-based 3D segmentation")
     print("- submit_sam_task(): Interactive segmentation with SAM")
+    print("- submit_tasks(): Submit many tasks to one folder in parallel")
     print("- check_task_status(): Check task processing status")
     print("- example_brain_metastases_segmentation(): Example brain mets task")
     print("- example_interactive_sam_segmentation(): Example SAM task")
\ No newline at end of file
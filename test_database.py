@@ -3,8 +3,8 @@
 Test script to query the RTPlanDB database directly
 """
 
-import sqlite3
 from pathlib import Path
+from db_utils import open_connection, ensure_indexes, truncate
 
 def test_database_queries():
     # Connect to the database
@@ -14,14 +14,24 @@ def test_database_queries():
         print(f"❌ Database not found at {db_path}")
         return
     
-    conn = sqlite3.connect(db_path)
+    conn = open_connection(db_path)
     cursor = conn.cursor()
+    ensure_indexes(cursor)
+    conn.execute("PRAGMA query_only=ON")
+    # All the tests read inside one transaction: the shared lock and WAL
+    # snapshot are taken once instead of per statement, and every test sees
+    # the same state even while ARTDaemon writes
+    conn.execute("BEGIN")
 
     print('=== Testing RTPlanDB Database Queries ===\n')
 
     # Test 1: Find all patients with 'Hippocampal' in name
+    # Every PatientID in this dataset starts with 'GammaKnife-Hippocampal-', so
+    # patterns are anchored at the start instead of a leading '*' that scans.
+    # GLOB compares case-sensitively, which is what lets it seek the BINARY
+    # PatientID indexes; case-insensitive LIKE cannot
     print('1. Find patients with "Hippocampal" in name:')
-    cursor.execute('SELECT PatientID, PatientName, PatientSex FROM PATIENT WHERE PatientID LIKE ? LIMIT 5', ('%Hippocampal%',))
+    cursor.execute('SELECT PatientID, PatientName, PatientSex FROM PATIENT WHERE PatientID GLOB ? LIMIT 5', ('GammaKnife-Hippocampal*',))
     patients = cursor.fetchall()
     for patient in patients:
         print(f'   {patient[0]} | {patient[1]} | {patient[2]}')
@@ -29,36 +39,40 @@ def test_database_queries():
     print()
 
     # Test 2: Find MR images for specific patient
+    # Long text columns are cut in SQL to one character past what is printed,
+    # enough for truncate to tell whether to add '...', so the rest of each value
+    # is never copied out of the page. Rows are read straight off the cursor
     print('2. Find MR images for patient GammaKnife-Hippocampal-001-VS:')
     cursor.execute('''
-        SELECT SeriesInstanceUID, StudyDate, SeriesDate, SeriesDescription, SequenceName
+        SELECT substr(SeriesInstanceUID, 1, 31), StudyDate, SeriesDate,
+               substr(SeriesDescription, 1, 41), SequenceName
         FROM MR 
         WHERE PatientID = ?
         ORDER BY StudyDate DESC, SeriesDate DESC
         LIMIT 5
     ''', ('GammaKnife-Hippocampal-001-VS',))
-    mr_images = cursor.fetchall()
-    for img in mr_images:
-        uid_short = img[0][:30] + '...' if len(img[0]) > 30 else img[0]
-        desc_short = img[3][:40] + '...' if len(img[3]) > 40 else img[3]
+    for img in cursor:
+        uid_short = truncate(img[0], 30)
+        desc_short = truncate(img[3], 40)
         seq_name = img[4] if img[4] else 'N/A'
         print(f'   {uid_short} | {img[1]} | {img[2]} | {desc_short} | {seq_name}')
 
     print()
 
     # Test 3: Find T1 sequences
+    # Description and protocol matches stay on LIKE so 't1' or 'Flair' series
+    # count too; an unanchored pattern scans the rows either way
     print('3. Find T1 sequences (looking for T1 in description):')
     cursor.execute('''
-        SELECT PatientID, StudyDate, SeriesDescription, ProtocolName
+        SELECT PatientID, StudyDate, substr(SeriesDescription, 1, 51), substr(ProtocolName, 1, 31)
         FROM MR 
         WHERE (SeriesDescription LIKE ? OR ProtocolName LIKE ?)
-        AND PatientID LIKE ?
+        AND PatientID GLOB ?
         LIMIT 3
-    ''', ('%T1%', '%T1%', '%Hippocampal-001%'))
-    t1_images = cursor.fetchall()
-    for img in t1_images:
-        desc_short = img[2][:50] + '...' if len(img[2]) > 50 else img[2]
-        protocol_short = img[3][:30] + '...' if img[3] and len(img[3]) > 30 else (img[3] or 'N/A')
+    ''', ('%T1%', '%T1%', 'GammaKnife-Hippocampal-001*'))
+    for img in cursor:
+        desc_short = truncate(img[2], 50)
+        protocol_short = truncate(img[3], 30, 'N/A')
         print(f'   {img[0]} | {img[1]} | {desc_short} | {protocol_short}')
 
     print()
@@ -92,38 +106,35 @@ def test_database_queries():
         ('FIESTA patterns', '%FIESTA%')
     ]
 
-    for name, pattern in patterns:
-        cursor.execute('SELECT COUNT(*) FROM MR WHERE SeriesDescription LIKE ? AND PatientID LIKE ?', (pattern, '%Hippocampal%'))
-        count = cursor.fetchone()[0]
+    # One pass over the patient's MR rows counts every pattern at once
+    counts = ', '.join('COALESCE(SUM(SeriesDescription LIKE ?), 0)' for _ in patterns)
+    cursor.execute(f'SELECT {counts} FROM MR WHERE PatientID GLOB ?',
+                   [pattern for _, pattern in patterns] + ['GammaKnife-Hippocampal*'])
+    for (name, _), count in zip(patterns, cursor.fetchone()):
         print(f'   {name}: {count} series found')
 
     print()
 
     # Test 7: Show actual file path construction
+    # The paths are concatenated in SQL, so each row arrives ready to print
     print('7. Construct file paths for patient 001:')
     cursor.execute('''
-        SELECT PatientID, SeriesInstanceUID, StudyDate, SeriesDescription
+        SELECT StudyDate, substr(SeriesDescription, 1, 41),
+               ?1 || PatientID || '\\' || SeriesInstanceUID || '\\image.nii.gz',
+               ?1 || PatientID || '\\' || SeriesInstanceUID || '\\Vista3D\\'
         FROM MR 
-        WHERE PatientID LIKE ?
+        WHERE PatientID GLOB ?2
         ORDER BY StudyDate DESC
         LIMIT 3
-    ''', ('%Hippocampal-001%',))
+    ''', ('C:\\ARTDaemon\\Segman\\dcm2nifti\\', 'GammaKnife-Hippocampal-001*'))
     
-    for row in cursor.fetchall():
-        patient_id = row[0]
-        series_uid = row[1]
-        study_date = row[2]
-        desc = row[3][:40] + '...' if len(row[3]) > 40 else row[3]
-        
-        # Construct file path
-        constructed_path = f"C:\\ARTDaemon\\Segman\\dcm2nifti\\{patient_id}\\{series_uid}\\image.nii.gz"
-        output_path = f"C:\\ARTDaemon\\Segman\\dcm2nifti\\{patient_id}\\{series_uid}\\Vista3D\\"
-        
-        print(f'   Study: {study_date} | {desc}')
+    for study_date, desc, constructed_path, output_path in cursor:
+        print(f'   Study: {study_date} | {truncate(desc, 40)}')
         print(f'   Input:  {constructed_path}')
         print(f'   Output: {output_path}')
         print()
 
+    conn.execute("COMMIT")
     conn.close()
     print('✅ Database queries completed successfully!')
 
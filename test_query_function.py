@@ -3,9 +3,10 @@
 Test the updated query_patient_images function
 """
 
-import sys
-import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from vista3d_mcp_server import Vista3DMCPServer
+from db_utils import open_connection, truncate
 
 def test_query_function():
     """Test the query function with actual schema"""
@@ -16,22 +17,34 @@ def test_query_function():
     print(f"Testing query_patient_images with schema-based approach...")
     print(f"Database path: {server.db_path}")
     
+    # The three queries are independent reads, so they run at once. A sqlite3
+    # connection belongs to the thread that opened it, so each worker opens its
+    # own read-only connection and passes its cursor to the shared server
+    def run_query(kwargs):
+        conn = open_connection(server.db_path, read_only=True)
+        try:
+            conn.row_factory = sqlite3.Row
+            return server.query_patient_images(cursor=conn.cursor(), **kwargs)
+        finally:
+            conn.close()
+    
+    calls = [
+        dict(modality="MR", filters={"patient_id": "GammaKnife-Hippocampal-001"}),
+        dict(modality="CT", filters={"patient_id": "GammaKnife-Hippocampal-001"}),
+        dict(modality="MR", filters={"patient_id": "GammaKnife-Hippocampal-001", "sequence_type": "T1"}),
+    ]
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        results, ct_results, t1_results = executor.map(run_query, calls)
+    
     # Test 1: Query MR images for a specific patient
     print("\n=== Test 1: Query MR images for patient GammaKnife-Hippocampal-001 ===")
-    results = server.query_patient_images(
-        patient_id="GammaKnife-Hippocampal-001",
-        modality="MR"
-    )
     
     print(f"Results: {len(results)} items")
     if results and "error" not in results[0]:
         print("✅ Success! Sample result:")
         sample = results[0]
         for key, value in sample.items():
-            if isinstance(value, str) and len(str(value)) > 50:
-                print(f"  {key}: {str(value)[:50]}...")
-            else:
-                print(f"  {key}: {value}")
+            print(f"  {key}: {truncate(value, 50) if isinstance(value, str) else value}")
     elif results:
         print(f"❌ Error: {results[0]}")
     else:
@@ -39,10 +52,6 @@ def test_query_function():
     
     # Test 2: Query CT images
     print("\n=== Test 2: Query CT images (first patient only) ===")
-    ct_results = server.query_patient_images(
-        modality="CT",
-        patient_id="GammaKnife-Hippocampal-001"
-    )
     
     print(f"CT Results: {len(ct_results)} items")
     if ct_results and "error" not in ct_results[0]:
@@ -53,11 +62,6 @@ def test_query_function():
     
     # Test 3: Test with sequence type filtering
     print("\n=== Test 3: Query T1 sequences ===")
-    t1_results = server.query_patient_images(
-        modality="MR",
-        sequence_type="T1",
-        patient_id="GammaKnife-Hippocampal-001"
-    )
     
     print(f"T1 Results: {len(t1_results)} items")
     if t1_results and "error" not in t1_results[0]:
@@ -4,15 +4,34 @@ Vista3D CLI - Command line interface for Vista3D MCP server
 Simple wrapper around the MCP client for common tasks
 """
 
-import json
+import os
+import signal
+import socket
 import subprocess
 import sys
 import argparse
 import time
 from pathlib import Path
+import json_utils
+
+# Where a server started with --daemon listens, and the file recording its
+# PID and the options it was started with. They live in the user's own
+# ~/.vista3d (created 700, as Config does) rather than the shared temp
+# directory, where another user could claim the names first
+DAEMON_DIR = os.path.join(os.path.expanduser("~"), ".vista3d")
+SOCKET_PATH = os.path.join(DAEMON_DIR, "cli.sock")
+PID_PATH = os.path.join(DAEMON_DIR, "cli.pid")
 
 class Vista3DCLI:
+    INIT_PARAMS = {
+        "protocolVersion": "2024-11-05",
+        "capabilities": {},
+        "clientInfo": {"name": "vista3d-cli", "version": "1.0.0"}
+    }
+    
     def __init__(self, tasks_path="/home/lbert/tasks-live", image_dirs="/home/lbert/claude-agent/sample_data"):
+        self.tasks_path = tasks_path
+        self.image_dirs = image_dirs
         self.server_command = [
             "python3", 
             "/home/lbert/claude-agent/vista3d_mcp_server.py",
@@ -20,59 +39,194 @@ class Vista3DCLI:
             "--image-dirs", image_dirs
         ]
         self.process = None
+        self.sock = None
+        self.stdin = None
+        self.stdout = None
         self.request_id = 0
+        self.initialized = False
         
     def start_server(self):
-        """Start the Vista3D MCP server"""
+        """Connect to a running daemon, or start the Vista3D MCP server"""
+        if self._connect_daemon():
+            return
+        
         print(f"Starting Vista3D server...")
+        # Binary, buffered pipes: whole lines are decoded at once instead of
+        # through a per-read text codec. The server's stderr log is not read
+        # here, so it is discarded rather than left to fill a pipe
         self.process = subprocess.Popen(
             self.server_command,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=0
+            stderr=subprocess.DEVNULL,
+            bufsize=-1
         )
+        self.stdin = self.process.stdin
+        self.stdout = self.process.stdout
+        
+    def _open_daemon_socket(self):
+        """Return a socket connected to the --daemon server, or None if none is listening"""
+        if not hasattr(socket, "AF_UNIX") or not os.path.exists(SOCKET_PATH):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(SOCKET_PATH)
+        except OSError:
+            sock.close()
+            return None
+        return sock
+        
+    @staticmethod
+    def _daemon_info():
+        """Return the PID file's record of the daemon, or None if there is none"""
+        try:
+            info = json_utils.loads(Path(PID_PATH).read_bytes())
+        except (OSError, json_utils.JSONDecodeError):
+            return None
+        return info if isinstance(info, dict) else None
+        
+    def _connect_daemon(self):
+        """Attach to the --daemon server's socket if one is listening"""
+        sock = self._open_daemon_socket()
+        if sock is None:
+            return False
+        
+        # The daemon serves the paths it was started with, so different
+        # options on this command would be silently ignored
+        info = self._daemon_info() or {}
+        if (info.get("tasks_path"), info.get("image_dirs")) != (self.tasks_path, self.image_dirs):
+            sock.close()
+            raise Exception(
+                f"Vista3D daemon on {SOCKET_PATH} was started with --tasks-path {info.get('tasks_path')} "
+                f"--image-dirs {info.get('image_dirs')}; pass the same options or run 'stop' first"
+            )
+        
+        self.sock = sock
+        self.stdin = self.stdout = sock.makefile("rwb")
+        return True
+        
+    def start_daemon(self):
+        """Start the server in the background, listening on SOCKET_PATH"""
+        if self._connect_daemon():
+            self.stop_server()
+            print(f"Vista3D daemon already running on {SOCKET_PATH}")
+            return
+        if os.path.exists(SOCKET_PATH):
+            os.unlink(SOCKET_PATH)  # Stale socket from a daemon that died
+        os.makedirs(DAEMON_DIR, mode=0o700, exist_ok=True)
+        
+        process = subprocess.Popen(
+            self.server_command + ["--socket", SOCKET_PATH],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        Path(PID_PATH).write_bytes(json_utils.dumps({
+            "pid": process.pid,
+            "tasks_path": self.tasks_path,
+            "image_dirs": self.image_dirs
+        }))
+        
+        deadline = time.time() + 10
+        while not os.path.exists(SOCKET_PATH):
+            if process.poll() is not None:
+                raise Exception(f"Daemon exited with code {process.returncode}")
+            if time.time() > deadline:
+                raise Exception("Daemon did not start listening within 10s")
+            time.sleep(0.05)
+        print(f"Vista3D daemon started (PID {process.pid}) on {SOCKET_PATH}")
+        
+    def stop_daemon(self):
+        """Stop the --daemon server and remove its socket and PID file"""
+        info = self._daemon_info()
+        sock = self._open_daemon_socket()
+        if sock is not None:
+            sock.close()
+        
+        # Only signal the recorded PID while the socket still answers, so a
+        # stale file never kills an unrelated process that reused the PID
+        if info is None or sock is None:
+            print("No Vista3D daemon is running")
+        else:
+            pid = info["pid"]
+            try:
+                os.kill(pid, signal.SIGTERM)  # The server flushes queued tasks, then exits
+                deadline = time.time() + 10
+                while time.time() < deadline:
+                    os.kill(pid, 0)
+                    time.sleep(0.05)
+                raise Exception(f"Daemon (PID {pid}) did not exit within 10s")
+            except ProcessLookupError:
+                pass
+            print(f"Vista3D daemon (PID {pid}) stopped")
+        
+        for path in (SOCKET_PATH, PID_PATH):
+            if os.path.exists(path):
+                os.unlink(path)
         
     def stop_server(self):
-        """Stop the server"""
-        if self.process:
+        """Stop the server, or just disconnect when it is the shared daemon"""
+        if self.sock:
+            self.stdin.close()
+            self.sock.close()
+            self.sock = None
+        elif self.process:
             self.process.terminate()
             self.process.wait()
             
     def send_request(self, method, params=None):
         """Send MCP request"""
-        self.request_id += 1
-        request = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "id": self.request_id
-        }
-        if params:
-            request["params"] = params
-            
-        request_json = json.dumps(request)
-        self.process.stdin.write(request_json + "\n")
-        self.process.stdin.flush()
+        return self.send_batch([(method, params)])[0]
         
-        response_line = self.process.stdout.readline()
-        if not response_line:
-            raise Exception("No response from server")
+    def send_batch(self, calls):
+        """Pipeline (method, params) requests in one write and return responses in call order"""
+        requests = []
+        for method, params in calls:
+            self.request_id += 1
+            request = {
+                "jsonrpc": "2.0",
+                "method": method,
+                "id": self.request_id
+            }
+            if params:
+                request["params"] = params
+            requests.append(request)
             
-        response = json.loads(response_line.strip())
+        # The server answers each line in turn, so it starts on the first
+        # request while the rest are still in the pipe
+        self.stdin.write(b"".join(json_utils.dumps(request) + b"\n" for request in requests))
+        self.stdin.flush()
         
-        if "error" in response:
-            raise Exception(f"Server error: {response['error']}")
+        responses = {}
+        for _ in requests:
+            response_line = self.stdout.readline()
+            if not response_line:
+                raise Exception("No response from server")
+            response = json_utils.loads(response_line)
+            responses[response.get("id")] = response
             
-        return response
+        ordered = [responses.get(request["id"], {}) for request in requests]
+        for response in ordered:
+            if "error" in response:
+                raise Exception(f"Server error: {response['error']}")
+                
+        return ordered
         
     def initialize(self):
         """Initialize connection"""
-        return self.send_request("initialize", {
-            "protocolVersion": "2024-11-05",
-            "capabilities": {},
-            "clientInfo": {"name": "vista3d-cli", "version": "1.0.0"}
-        })
+        response = self.send_request("initialize", self.INIT_PARAMS)
+        self.initialized = True
+        return response
+        
+    def call_tool(self, name, arguments):
+        """Call a tool and return its text, sending initialize in the same write if still needed"""
+        calls = [("tools/call", {"name": name, "arguments": arguments})]
+        if not self.initialized:
+            calls.insert(0, ("initialize", self.INIT_PARAMS))
+        response = self.send_batch(calls)[-1]
+        self.initialized = True
+        return response["result"]["content"][0]["text"]
         
     def submit_task(self, input_file, output_dir, x, y, z, patient_id=None, series_uid=None):
         """Submit Vista3D segmentation task"""
@@ -87,35 +241,22 @@ class Vista3DCLI:
         if series_uid:
             args["series_uid"] = series_uid
             
-        response = self.send_request("tools/call", {
-            "name": "submit_vista3d_point_task",
-            "arguments": args
-        })
-        
-        return response["result"]["content"][0]["text"]
+        return self.call_tool("submit_vista3d_point_task", args)
         
     def check_status(self, task_id):
         """Check task status"""
-        response = self.send_request("tools/call", {
-            "name": "check_vista3d_task_status", 
-            "arguments": {"task_id": task_id}
-        })
-        
-        return response["result"]["content"][0]["text"]
+        return self.call_tool("check_vista3d_task_status", {"task_id": task_id})
         
     def list_images(self):
         """List available images"""
-        response = self.send_request("tools/call", {
-            "name": "list_available_images",
-            "arguments": {}
-        })
-        
-        return response["result"]["content"][0]["text"]
+        return self.call_tool("list_available_images", {})
 
 def main():
     parser = argparse.ArgumentParser(description="Vista3D CLI - Medical image segmentation")
     parser.add_argument("--tasks-path", default="/home/lbert/tasks-live", help="Tasks directory path")
     parser.add_argument("--image-dirs", default="/home/lbert/claude-agent/sample_data", help="Image directories")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Start a background server that later commands reuse instead of spawning their own")
     
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
     
@@ -136,17 +277,36 @@ def main():
     # List command
     list_parser = subparsers.add_parser("list", help="List available images")
     
+    # Stop command
+    stop_parser = subparsers.add_parser("stop", help="Stop the background server started with --daemon")
+    
     args = parser.parse_args()
     
+    cli = Vista3DCLI(args.tasks_path, args.image_dirs)
+    
+    if args.daemon:
+        try:
+            cli.start_daemon()
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+        
     if not args.command:
         parser.print_help()
         return
-        
-    cli = Vista3DCLI(args.tasks_path, args.image_dirs)
+    
+    if args.command == "stop":
+        try:
+            cli.stop_daemon()
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
     
     try:
+        # initialize goes out in the same write as the first tool call
         cli.start_server()
-        cli.initialize()
         
         if args.command == "submit":
             result = cli.submit_task(
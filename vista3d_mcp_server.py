@@ -6,21 +6,274 @@ This MCP server provides tools for submitting and monitoring Vista3D segmentatio
 in the ARTDaemon system. It uses stdio transport for communication with Claude Code.
 """
 
-import json
 import sys
 import time
 import os
 import argparse
+import itertools
 import sqlite3
 import re
+import socket
+import signal
+import queue
+import threading
 import logging
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union
+from db_utils import open_connection
+import json_utils
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# MR sequence classifiers from SegmanRepo used by _classify_mr_sequence,
+# compiled once at import
+_T1_RE = re.compile(r"(^|[_\-\s])(?!.*FLAIR)[a-zA-Z0-9]*?(T1(W|WI)?|T1[-_ ]?weighted|T1W|MP[_\-\s]?RAGE|SPGR|FSPGR|FLASH|GRE|FFE|TFE|MP2RAGE|BRAVO|VIBE|LAVA|THRIVE|T1C|T1CE|mASTAR)([_\-\s]|$)", re.IGNORECASE)
+_T1C_RE = re.compile(r"(^|[\s_\-]).*?((POST|GAD|CONTRAST|CE|\+C).*?(T1W|T1(W|WI)?|T1[-_ ]?WEIGHTED|MP[\s_\-]?RAGE|SPGR|FSPGR|FLASH|GRE|FFE|TFE|MP2RAGE|BRAVO)|(T1W|T1(W|WI)?|T1[-_ ]?WEIGHTED|MP[\s_\-]?RAGE|SPGR|FSPGR|FLASH|GRE|FFE|TFE|MP2RAGE|BRAVO).*?(POST|GAD|CONTRAST|CE|\+C)|VIBE|LAVA|THRIVE|T1C|T1CE|MASTAR)([\s_\-]|$)", re.IGNORECASE)
+_T1NC_RE = re.compile(r"^(?!.*(POST|GAD|CONTRAST|CE|\+C|VIBE|LAVA|THRIVE|T1C|T1CE|MASTAR)).*?([_\-\s]|^)[A-Z0-9]*?(T1(W|WI)?|T1[-_ ]?WEIGHTED|T1W|MP[\s_\-]?RAGE|SPGR|FSPGR|FLASH|GRE|FFE|TFE|MP2RAGE|BRAVO)([_\-\s]|$)", re.IGNORECASE)
+_T2_RE = re.compile(r"^(?!.*(FLAIR|T1W|T1WI|T1[-_ ]?WEIGHTED|T1)).*?([_\-\s]|^)(T2(W|WI)?|T2[-_ ]?WEIGHTED|STIR|FSE|TSE|CISS|SPACE|VISTA|CUBE|PROP(?:ELLER)?|BLADE|FIESTA|TRUEFISP|BSSFP|DRIVE)([_\-\s]|$)", re.IGNORECASE)
+_FLAIR_RE = re.compile(r"^(?!.*(T1W|T1WI|T1[-_ ]?WEIGHTED|T1)).*?(FLAIR|T2[\s_\-]?FLAIR|FLAIR[\s_\-]?T2|IR[\s_\-]?(T2|FSE|TSE)?[\s_\-]?FLAIR|FLAIRV\d*|FLUID[\s_\-]?ATTENUATED)([\s_\-]|$)", re.IGNORECASE)
+_DWI_RE = re.compile(r"(^|[_\-\s])[a-zA-Z0-9]*?(DWI(_?EPI)?|EPI[_\- ]?DWI|Diffusion(_?Weighted)?|DTI(_\d+dir)?|ADC)([_\-\s]|$)", re.IGNORECASE)
+
+# Tools whose arguments are checked against their inputSchema before running,
+# when fastjsonschema is installed: the ones that write tasks or name a file
+VALIDATED_TOOLS = ("submit_vista3d_point_task", "check_vista3d_task_status", "submit_full_body_task")
+
+# Most bytes run() takes from stdin per read
+STDIN_READ_SIZE = 64 * 1024
+
+# Bytes a JSON value can start with; handle_line drops any other line
+# without running the parser
+JSON_VALUE_START = frozenset(b'{["-0123456789tfn')
+
+# JSON-RPC error reply with the id, code and JSON-encoded message spliced in
+ERROR_RESPONSE_TEMPLATE = b'{"jsonrpc":"2.0","id":%b,"error":{"code":%d,"message":%b}}'
+
+# Reply to an empty JSON-RPC batch, which carries no id to echo
+EMPTY_BATCH_RESPONSE = b'{"jsonrpc":"2.0","id":null,"error":{"code":-32600,"message":"Invalid Request: empty batch"}}'
+
+# Filesystems whose inotify events cover every change. Folders on anything
+# else, such as the drvfs/9p mount of C:\ARTDaemon that ARTDaemon changes from
+# the Windows side, are only ever polled
+INOTIFY_FILESYSTEMS = frozenset(("ext2", "ext3", "ext4", "xfs", "btrfs", "f2fs", "zfs", "tmpfs", "overlay"))
+
+# Seconds before a watched folder is listed again anyway, in case a change
+# happened that inotify did not report
+WATCHED_RESCAN_SECONDS = 1.0
+
+# Finished tasks whose status check_task_status keeps in memory
+TERMINAL_STATUS_CACHE_SIZE = 4096
+
+# Keys every point task starts with, in the order they are written; copied
+# per task so the fixed entries are not rebuilt each time
+POINT_TASK_TEMPLATE = {
+    "task_id": None,
+    "input_file": None,
+    "output_directory": None,
+    "segmentation_type": "point",
+    "segmentation_prompts": None,
+    "modality": "MR"
+}
+
+# Column definitions that query_patient_images builds its SELECTs from
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rtplandb_schema.json")
+
+# Result of the initialize handshake
+INITIALIZE_RESULT = {
+    "protocolVersion": "2024-11-05",
+    "capabilities": {
+        "tools": {}
+    },
+    "serverInfo": {
+        "name": "vista3d-mcp-server",
+        "version": "1.0.0"
+    }
+}
+
+# Tool definitions returned by tools/list; they never change at runtime
+TOOLS = [
+    {
+        "name": "submit_vista3d_point_task",
+        "description": "Submit a point-based segmentation task to Vista3D",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "point_coordinates": {
+                    "type": "array",
+                    "items": {"type": "integer"},
+                    "minItems": 3,
+                    "maxItems": 3,
+                    "description": "3D coordinates [x, y, z] for the seed point"
+                },
+                "point_type": {
+                    "type": "string",
+                    "enum": ["positive", "negative"],
+                    "default": "positive",
+                    "description": "Type of point prompt"
+                },
+                "additional_points": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "coordinates": {
+                                "type": "array",
+                                "items": {"type": "integer"},
+                                "minItems": 3,
+                                "maxItems": 3
+                            },
+                            "type": {
+                                "type": "string",
+                                "enum": ["positive", "negative"]
+                            }
+                        },
+                        "required": ["coordinates", "type"]
+                    },
+                    "description": "Additional points for refinement"
+                },
+                "input_file": {
+                    "type": "string",
+                    "description": "Path to input NIfTI file (required)"
+                },
+                "output_directory": {
+                    "type": "string",
+                    "description": "Path to output directory (required)"
+                },
+                "patient_id": {
+                    "type": "string",
+                    "description": "Patient ID (optional)"
+                },
+                "series_uid": {
+                    "type": "string",
+                    "description": "Series instance UID (optional)"
+                }
+            },
+            "required": ["point_coordinates", "input_file", "output_directory"]
+        }
+    },
+    {
+        "name": "check_vista3d_task_status",
+        "description": "Check the status of a Vista3D task",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "task_id": {
+                    "type": "string",
+                    "description": "Task ID to check"
+                }
+            },
+            "required": ["task_id"]
+        }
+    },
+    {
+        "name": "submit_full_body_task",
+        "description": "Submit a full body segmentation task",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "input_file": {
+                    "type": "string",
+                    "description": "Path to input NIfTI file (required)"
+                },
+                "output_directory": {
+                    "type": "string",
+                    "description": "Path to output directory (required)"
+                },
+                "description": {
+                    "type": "string",
+                    "description": "Description of the segmentation task (optional)"
+                },
+                "patient_id": {
+                    "type": "string",
+                    "description": "Patient ID (optional)"
+                },
+                "series_uid": {
+                    "type": "string",
+                    "description": "Series instance UID (optional)"
+                }
+            },
+            "required": ["input_file", "output_directory"]
+        }
+    },
+    {
+        "name": "query_patient_images",
+        "description": "Query SQLite database to find patient images using dynamic schema-based filtering",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "modality": {
+                    "type": "string",
+                    "description": "Imaging modality (MR, CT, PT) - determines which table to query"
+                },
+                "filters": {
+                    "type": "object",
+                    "description": "Dictionary of column_name: value pairs for filtering. Column names should match database schema. Use 'sequence_type' for MR sequence filtering (T1, T1C, T1NC, T2, FLAIR, DWI, etc.)",
+                    "additionalProperties": {
+                        "type": "string"
+                    }
+                }
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "list_available_images",
+        "description": "List available input images for processing",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "search_directory": {
+                    "type": "string",
+                    "description": "Directory path to search for .nii.gz images (optional)"
+                }
+            }
+        }
+    }
+]
+
+
+def _iter_nifti_files(root: str):
+    """Yield the path of every .nii.gz file under root, without following directory symlinks"""
+    # An explicit stack over os.scandir: DirEntry answers is_dir from the
+    # directory listing itself, and no Path object is built per entry
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue  # Missing or unreadable directory, as rglob skips it
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".nii.gz"):
+                    yield entry.path
 
 
 class Vista3DMCPServer:
     """MCP Server for Vista3D task management."""
     
+    # Fixed attribute layout: no per-instance __dict__, and the attributes
+    # read on every request resolve to slot offsets
+    __slots__ = (
+        "logger", "tasks_base_path", "db_path",
+        "vista3d_tasks_path", "vista3d_processed_path",
+        "_tasks_path_str", "_processed_path_str",
+        "_conn", "_cursor", "_schema", "_schema_mtime", "_base_queries",
+        "_sequence_cache", "_tools_list_tail", "_initialize_tail",
+        "_methods", "_tools", "_validators", "_dir_cache", "_watched",
+        "_terminal_status", "_write_queue", "_queued_task_ids", "_failed_writes",
+        "_statvfs_cache", "_id_prefix", "_id_counter",
+    )
+    
     def __init__(self, tasks_base_path: Optional[str] = None, db_path: Optional[str] = None):
         # Set up logging
         self._setup_logging()
@@ -43,12 +296,85 @@ class Vista3DMCPServer:
             config = Config()
             self.db_path = config.get_database_path()
         
+        # Opened on first query and reused so prepared statements stay cached
+        self._conn = None
+        self._cursor = None
+        
+        # Parsed rtplandb_schema.json and the per-table SELECT prefixes built
+        # from it, refreshed when the file's mtime changes
+        self._schema = None
+        self._schema_mtime = None
+        self._base_queries: Dict[str, str] = {}
+        
+        # SeriesDescription -> sequence types from _classify_mr_sequence
+        self._sequence_cache: Dict[str, List[str]] = {}
+        
+        # The static replies are serialized once, everything after the id
+        # included, so each response only puts the id between a short head
+        # and the cached tail and the large tools list is copied once
+        self._tools_list_tail = self._reply_tail(json_utils.dumps({"tools": TOOLS}))
+        self._initialize_tail = self._reply_tail(json_utils.dumps(INITIALIZE_RESULT))
+        
+        # Handlers looked up by JSON-RPC method and by tool name
+        self._methods = {
+            "tools/list": self._h_tools_list,
+            "tools/call": self._h_tools_call,
+            "initialize": self._h_initialize,
+        }
+        self._tools = {
+            "submit_vista3d_point_task": self._tool_submit_point,
+            "check_vista3d_task_status": self._tool_check_status,
+            "submit_full_body_task": self._tool_submit_full_body,
+            "query_patient_images": self._tool_query_patient_images,
+            "list_available_images": self._tool_list_available_images,
+        }
+        
+        # fastjsonschema generates a validator function specialized to each
+        # schema, so the schema is walked once here rather than per call
+        self._validators = {}
+        if fastjsonschema:
+            self._validators = {
+                tool["name"]: fastjsonschema.compile(tool["inputSchema"])
+                for tool in TOOLS if tool["name"] in VALIDATED_TOOLS
+            }
+        
+        # Task folder path -> (monotonic time listed, file names); see _listing
+        self._dir_cache: Dict[str, tuple] = {}
+        
+        # task_id -> status of tasks that finished with a result, least
+        # recently checked first; a finished task never changes again
+        self._terminal_status: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        
+        # submit_task hands encoded tasks to a background writer so the request
+        # loop never waits on the disk; queued ids still report as pending
+        self._write_queue: queue.Queue = queue.Queue(maxsize=4096)
+        self._queued_task_ids = set()
+        # task_id -> error for task files the writer could not write, so a
+        # status check reports the failure instead of not_found; only the
+        # writer thread changes it
+        self._failed_writes: Dict[str, str] = {}
+        # (monotonic time checked, free bytes) for the tasks volume; see _free_bytes
+        self._statvfs_cache = (float("-inf"), None)
+        threading.Thread(target=self._writer_loop, name="task-writer", daemon=True).start()
+        
         self.vista3d_tasks_path = Path(self.tasks_base_path) / "Vista3D"
         self.vista3d_processed_path = Path(self.tasks_base_path.replace("tasks-live", "tasks-history")) / "Vista3d"
+        # Plain-string forms for the os.path joins on the submit/status paths
+        self._tasks_path_str = str(self.vista3d_tasks_path)
+        self._processed_path_str = str(self.vista3d_processed_path)
+        
+        # Task IDs are <prefix>_<start time in ns>_<n>: unique across restarts
+        # and never repeated within one run, however fast tasks arrive
+        self._id_prefix = f"{time.time_ns()}_"
+        self._id_counter = itertools.count().__next__
         
         # Validate and create directories
         self._validate_and_create_directories()
         
+        # Task folder path -> file names kept current by inotify; see _start_watching
+        self._watched: Dict[str, set] = {}
+        self._start_watching()
+        
         self.logger.info(f"Vista3D MCP Server initialized:")
         self.logger.info(f"  Tasks base path: {self.tasks_base_path}")
         self.logger.info(f"  Database path: {self.db_path}")
@@ -83,34 +409,28 @@ class Vista3DMCPServer:
         desc = series_description.strip()
         
         # T1 general filter (includes both contrast and non-contrast)
-        t1_pattern = r"(^|[_\-\s])(?!.*FLAIR)[a-zA-Z0-9]*?(T1(W|WI)?|T1[-_ ]?weighted|T1W|MP[_\-\s]?RAGE|SPGR|FSPGR|FLASH|GRE|FFE|TFE|MP2RAGE|BRAVO|VIBE|LAVA|THRIVE|T1C|T1CE|mASTAR)([_\-\s]|$)"
-        if re.search(t1_pattern, desc, re.IGNORECASE):
+        if _T1_RE.search(desc):
             matches.append("T1")
         
         # T1C (T1 with contrast)
-        t1c_pattern = r"(^|[\s_\-]).*?((POST|GAD|CONTRAST|CE|\+C).*?(T1W|T1(W|WI)?|T1[-_ ]?WEIGHTED|MP[\s_\-]?RAGE|SPGR|FSPGR|FLASH|GRE|FFE|TFE|MP2RAGE|BRAVO)|(T1W|T1(W|WI)?|T1[-_ ]?WEIGHTED|MP[\s_\-]?RAGE|SPGR|FSPGR|FLASH|GRE|FFE|TFE|MP2RAGE|BRAVO).*?(POST|GAD|CONTRAST|CE|\+C)|VIBE|LAVA|THRIVE|T1C|T1CE|MASTAR)([\s_\-]|$)"
-        if re.search(t1c_pattern, desc, re.IGNORECASE):
+        if _T1C_RE.search(desc):
             matches.append("T1C")
         
         # T1NC (T1 without contrast) - only if T1 matches but T1C doesn't
         if "T1" in matches and "T1C" not in matches:
-            t1nc_pattern = r"^(?!.*(POST|GAD|CONTRAST|CE|\+C|VIBE|LAVA|THRIVE|T1C|T1CE|MASTAR)).*?([_\-\s]|^)[A-Z0-9]*?(T1(W|WI)?|T1[-_ ]?WEIGHTED|T1W|MP[\s_\-]?RAGE|SPGR|FSPGR|FLASH|GRE|FFE|TFE|MP2RAGE|BRAVO)([_\-\s]|$)"
-            if re.search(t1nc_pattern, desc, re.IGNORECASE):
+            if _T1NC_RE.search(desc):
                 matches.append("T1NC")
         
         # T2 filter
-        t2_pattern = r"^(?!.*(FLAIR|T1W|T1WI|T1[-_ ]?WEIGHTED|T1)).*?([_\-\s]|^)(T2(W|WI)?|T2[-_ ]?WEIGHTED|STIR|FSE|TSE|CISS|SPACE|VISTA|CUBE|PROP(?:ELLER)?|BLADE|FIESTA|TRUEFISP|BSSFP|DRIVE)([_\-\s]|$)"
-        if re.search(t2_pattern, desc, re.IGNORECASE):
+        if _T2_RE.search(desc):
             matches.append("T2")
         
         # FLAIR filter
-        flair_pattern = r"^(?!.*(T1W|T1WI|T1[-_ ]?WEIGHTED|T1)).*?(FLAIR|T2[\s_\-]?FLAIR|FLAIR[\s_\-]?T2|IR[\s_\-]?(T2|FSE|TSE)?[\s_\-]?FLAIR|FLAIRV\d*|FLUID[\s_\-]?ATTENUATED)([\s_\-]|$)"
-        if re.search(flair_pattern, desc, re.IGNORECASE):
+        if _FLAIR_RE.search(desc):
             matches.append("FLAIR")
         
         # DWI filter
-        dwi_pattern = r"(^|[_\-\s])[a-zA-Z0-9]*?(DWI(_?EPI)?|EPI[_\- ]?DWI|Diffusion(_?Weighted)?|DTI(_\d+dir)?|ADC)([_\-\s]|$)"
-        if re.search(dwi_pattern, desc, re.IGNORECASE):
+        if _DWI_RE.search(desc):
             matches.append("DWI")
         
         return matches
@@ -128,9 +448,8 @@ class Vista3DMCPServer:
             raise ValueError(f"Permission denied creating directories in: {self.tasks_base_path}")
     
     def generate_task_id(self, prefix: str = "vista3d_point") -> str:
-        """Generate a unique task ID with timestamp."""
-        timestamp = int(time.time() * 1000)
-        return f"{prefix}_{timestamp}"
+        """Generate a unique task ID from the server's start time and a counter."""
+        return f"{prefix}_{self._id_prefix}{self._id_counter()}"
     
     def create_vista3d_task(
         self,
@@ -150,20 +469,18 @@ class Vista3DMCPServer:
         if task_id is None:
             task_id = self.generate_task_id()
         
-        task = {
-            "task_id": task_id,
-            "input_file": input_file,
-            "output_directory": output_directory,
-            "segmentation_type": "point",
-            "segmentation_prompts": [
-                {
-                    "target_output_label": label,
-                    "positive_points": [point_coordinates] if point_type == "positive" else [],
-                    "negative_points": [point_coordinates] if point_type == "negative" else []
-                }
-            ],
-            "modality": modality
-        }
+        task = POINT_TASK_TEMPLATE.copy()
+        task["task_id"] = task_id
+        task["input_file"] = input_file
+        task["output_directory"] = output_directory
+        task["segmentation_prompts"] = [
+            {
+                "target_output_label": label,
+                "positive_points": [point_coordinates] if point_type == "positive" else [],
+                "negative_points": [point_coordinates] if point_type == "negative" else []
+            }
+        ]
+        task["modality"] = modality
         
         # Only include optional fields if provided
         if patient_id:
@@ -215,22 +532,205 @@ class Vista3DMCPServer:
     def submit_task(self, task: Dict[str, Any]) -> str:
         """Submit a task by writing TSK file to Vista3D tasks folder."""
         task_id = task["task_id"]
-        filename = f"{task_id}.tsk"
-        task_file_path = self.vista3d_tasks_path / filename
+        task_file_path = os.path.join(self._tasks_path_str, f"{task_id}.tsk")
         
         try:
-            with open(task_file_path, 'w') as f:
-                json.dump(task, f, indent=2)
-            return str(task_file_path)
+            data = json_utils.dumps(task, indent=True)
+            free_bytes = self._free_bytes()
+            if free_bytes is not None and free_bytes < len(data) + 4096:
+                raise OSError(f"Not enough free space in {self._tasks_path_str} ({free_bytes} bytes left)")
+            self._queued_task_ids.add(task_id)
+            self._write_queue.put((task_id, task_file_path, data))
+            return task_file_path
         except Exception as e:
             raise Exception(f"Failed to submit task: {str(e)}")
     
+    def _free_bytes(self) -> Optional[int]:
+        """Free space on the tasks volume, from an os.statvfs at most 0.5s old; None where unavailable."""
+        if not hasattr(os, "statvfs"):
+            return None
+        now = time.monotonic()
+        checked, free_bytes = self._statvfs_cache
+        if now - checked > 0.5:
+            try:
+                stats = os.statvfs(self._tasks_path_str)
+                free_bytes = stats.f_bavail * stats.f_frsize
+            except OSError:
+                free_bytes = None
+            self._statvfs_cache = (now, free_bytes)
+        return free_bytes
+    
+    def _writer_loop(self):
+        """Write queued task files, each under a temporary name renamed into place."""
+        while True:
+            task_id, task_file_path, data = self._write_queue.get()
+            tmp_path = task_file_path + ".tmp"
+            try:
+                # Unbuffered writes of the already-encoded bytes, repeated until
+                # all of them are down; the rename means ARTDaemon never sees a
+                # partially written .tsk
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(fd, view):]
+                finally:
+                    os.close(fd)
+                os.replace(tmp_path, task_file_path)
+                watched = self._watched.get(self._tasks_path_str)
+                if watched is not None:
+                    # Recorded now rather than when the inotify event lands, so
+                    # the task never briefly reads as not found. If ARTDaemon
+                    # already took the file and the watcher applied that event
+                    # first, the name would stay forever; the exists check
+                    # after adding catches that case
+                    name = os.path.basename(task_file_path)
+                    watched.add(name)
+                    if not os.path.exists(task_file_path):
+                        watched.discard(name)
+            except OSError as e:
+                self.logger.error(f"❌ Failed to write task {task_id}: {e}")
+                # Recorded before the id leaves _queued_task_ids, so the task
+                # goes straight from pending to failed
+                self._failed_writes[task_id] = str(e)
+                if len(self._failed_writes) > TERMINAL_STATUS_CACHE_SIZE:
+                    del self._failed_writes[next(iter(self._failed_writes))]
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass  # Never created, or not removable; the writer keeps going
+            finally:
+                if self._tasks_path_str not in self._watched:
+                    self._dir_cache.pop(self._tasks_path_str, None)  # Show the file at once
+                self._queued_task_ids.discard(task_id)
+                self._write_queue.task_done()
+    
+    def flush_writes(self):
+        """Block until every submitted task file has been written."""
+        self._write_queue.join()
+    
+    def exit_on_sigterm(self):
+        """Wait for SIGTERM (blocked in every thread), flush queued task files, then exit."""
+        signal.sigwait({signal.SIGTERM})
+        self.flush_writes()
+        os._exit(0)
+    
+    @staticmethod
+    def _scan(folder: str) -> set:
+        """Return the names in folder, or an empty set if it cannot be listed."""
+        try:
+            with os.scandir(folder) as entries:
+                return {entry.name for entry in entries}
+        except OSError:
+            return set()
+    
+    def _listing(self, folder: str, ttl: float = 0.1) -> set:
+        """Return the file names in folder, re-listing it at most once per ttl seconds (WATCHED_RESCAN_SECONDS if watched)."""
+        now = time.monotonic()
+        watched = self._watched.get(folder)
+        if watched is not None:
+            # inotify keeps the set current between these backstop rescans
+            checked = self._dir_cache.get(folder)
+            if checked is not None and now - checked[0] <= WATCHED_RESCAN_SECONDS:
+                return watched
+            watched = self._watched[folder] = self._scan(folder)
+            self._dir_cache[folder] = (now, watched)
+            return watched
+        cached = self._dir_cache.get(folder)
+        if cached is None or now - cached[0] > ttl:
+            cached = self._dir_cache[folder] = (now, self._scan(folder))
+        return cached[1]
+    
+    @staticmethod
+    def _filesystem_type(folder: str) -> Optional[str]:
+        """Return the type of the filesystem folder is on, from /proc/mounts; None if unknown."""
+        path = os.path.realpath(folder)
+        best, fs_type = "", None
+        try:
+            with open("/proc/mounts") as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+                    # Spaces and the like are octal-escaped in mount points
+                    mount_point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), fields[1])
+                    inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+                    if inside and len(mount_point) >= len(best):
+                        best, fs_type = mount_point, fields[2]
+        except OSError:
+            return None
+        return fs_type
+    
+    def _start_watching(self):
+        """Follow the task folders through inotify, when inotify_simple is installed, so lookups need no syscalls."""
+        if inotify_simple is None:
+            return
+        try:
+            inotify = inotify_simple.INotify()
+        except (OSError, AttributeError):
+            return  # Not Linux
+        
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.MOVED_TO | flags.DELETE | flags.MOVED_FROM
+        watches = {}
+        for folder in (self._tasks_path_str, self._processed_path_str):
+            if self._filesystem_type(folder) not in INOTIFY_FILESYSTEMS:
+                continue  # Changes made by other machines would go unreported
+            try:
+                watches[inotify.add_watch(folder, mask)] = folder
+            except OSError:
+                continue  # Not created yet; _listing keeps polling it
+            # Listed after the watch is in place, so no change is missed
+            self._watched[folder] = self._scan(folder)
+        
+        if watches:
+            threading.Thread(target=self._watch_loop, args=(inotify, watches), name="task-watcher", daemon=True).start()
+        else:
+            inotify.close()
+    
+    def _watch_loop(self, inotify, watches: Dict[int, str]):
+        """Apply inotify events to the _watched listings."""
+        flags = inotify_simple.flags
+        added = flags.CREATE | flags.MOVED_TO
+        while True:
+            for event in inotify.read():
+                if event.mask & flags.Q_OVERFLOW:
+                    # Events were dropped; start again from fresh listings
+                    for folder in watches.values():
+                        if folder in self._watched:
+                            self._watched[folder] = self._scan(folder)
+                    continue
+                folder = watches.get(event.wd)
+                if event.mask & flags.IGNORED:
+                    # The folder itself went away; fall back to polling it
+                    self._watched.pop(folder, None)
+                    continue
+                names = self._watched.get(folder)
+                if names is None:
+                    continue
+                if event.mask & added:
+                    names.add(event.name)
+                else:
+                    names.discard(event.name)
+    
     def check_task_status(self, task_id: str) -> Dict[str, Any]:
         """Check the status of a submitted task."""
+        cached = self._terminal_status.get(task_id)
+        if cached is not None:
+            self._terminal_status.move_to_end(task_id)
+            return cached
+        
+        write_error = self._failed_writes.get(task_id)
+        if write_error is not None:
+            return {
+                "status": "failed",
+                "task_id": task_id,
+                "message": f"Task file could not be written: {write_error}"
+            }
         
-        # Check if task is still pending in tasks folder
-        pending_file = self.vista3d_tasks_path / f"{task_id}.tsk"
-        if pending_file.exists():
+        # Check if task is still pending in tasks folder. Lookups are set
+        # membership tests on cached listings rather than a stat per file
+        if task_id in self._queued_task_ids or f"{task_id}.tsk" in self._listing(self._tasks_path_str):
             return {
                 "status": "pending",
                 "task_id": task_id,
@@ -238,25 +738,33 @@ class Vista3DMCPServer:
             }
         
         # Check if task is processed
-        processed_file = self.vista3d_processed_path / f"{task_id}.json"
-        result_file = self.vista3d_processed_path / f"{task_id}_result.json"
+        processed_names = self._listing(self._processed_path_str)
         
-        if processed_file.exists():
+        if task_id + ".json" in processed_names:
             status = {
                 "status": "processed",
                 "task_id": task_id,
-                "processed_file": str(processed_file)
+                "processed_file": os.path.join(self._processed_path_str, task_id + ".json")
             }
             
-            if result_file.exists():
+            result_name = task_id + "_result.json"
+            if result_name in processed_names:
                 try:
-                    with open(result_file, 'r') as f:
-                        result_data = json.load(f)
+                    # The file's own text is kept for display, so the bytes are
+                    # read once and serve both the parse and the status text
+                    with open(os.path.join(self._processed_path_str, result_name), 'rb') as f:
+                        result_bytes = f.read()
+                    result_data = json_utils.loads(result_bytes)
                     status["result"] = result_data
+                    status["result_bytes"] = result_bytes
                     if "output_mask" in result_data:
                         status["output_mask"] = result_data["output_mask"]
                 except Exception as e:
                     status["result_error"] = str(e)
+                else:
+                    self._terminal_status[task_id] = status
+                    if len(self._terminal_status) > TERMINAL_STATUS_CACHE_SIZE:
+                        self._terminal_status.popitem(last=False)
             
             return status
         
@@ -273,38 +781,75 @@ class Vista3DMCPServer:
         
         if search_directory:
             # Use provided directory
-            if Path(search_directory).exists():
-                for img_file in Path(search_directory).rglob("*.nii.gz"):
-                    image_paths.append(str(img_file))
+            image_paths.extend(_iter_nifti_files(search_directory))
         else:
             # Check environment variable for image directories
             env_dirs = os.getenv("VISTA3D_IMAGE_DIRS", "")
             if env_dirs:
                 image_dirs = [d.strip() for d in env_dirs.split(":") if d.strip()]
                 for dir_path in image_dirs:
-                    if dir_path and Path(dir_path).exists():
-                        for img_file in Path(dir_path).rglob("*.nii.gz"):
-                            image_paths.append(str(img_file))
+                    image_paths.extend(_iter_nifti_files(dir_path))
         
         return image_paths
     
 
+    def _get_cursor(self) -> sqlite3.Cursor:
+        """Return the shared cursor on the read-only database connection, opening it on first use"""
+        if self._conn is None:
+            self._conn = open_connection(self.db_path, read_only=True)
+            self._conn.row_factory = sqlite3.Row  # Enable column access by name
+            self._cursor = self._conn.cursor()
+        return self._cursor
+    
+    def _load_schema(self) -> Dict[str, Any]:
+        """Return the parsed rtplandb_schema.json, re-reading it only when its mtime changes"""
+        mtime = os.stat(SCHEMA_PATH).st_mtime_ns
+        if self._schema is None or mtime != self._schema_mtime:
+            self._schema = json_utils.load_file(SCHEMA_PATH)
+            self._schema_mtime = mtime
+            self._base_queries = {}
+        return self._schema
+    
+    def _base_query(self, table: str, table_columns: List[str]) -> str:
+        """Return the SELECT ... FROM table WHERE 1=1 prefix, built once per schema load"""
+        # The query is returned from the local rather than read back from
+        # _base_queries, which _load_schema may replace from another thread
+        query = self._base_queries.get(table)
+        if query is None:
+            # Build column list for SELECT statement - use all columns from schema
+            select_columns = []
+            for col in table_columns:
+                # Use snake_case alias for all columns
+                alias = col.lower().replace(' ', '_')
+                select_columns.append(f"{col} as {alias}")
+            
+            query = f"""
+            SELECT DISTINCT 
+                {', '.join(select_columns)}
+            FROM {table} 
+            WHERE 1=1
+            """
+            self._base_queries[table] = query
+        return query
+    
     def query_patient_images(self, modality: Optional[str] = None, 
-                           filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+                           filters: Optional[Dict[str, Any]] = None,
+                           cursor: Optional[sqlite3.Cursor] = None) -> List[Dict[str, Any]]:
         """Query SQLite database to find patient images based on actual database schema
         
         Args:
             modality: Imaging modality (MR, CT, PT) - determines which table to query
             filters: Dictionary of column_name: value pairs for filtering
+            cursor: Cursor to run the query on instead of the shared one, e.g. from
+                another thread's connection (needs row_factory = sqlite3.Row)
         """
         
-        if not Path(self.db_path).exists():
+        if not os.path.exists(self.db_path):
             return [{"error": f"Database not found at {self.db_path}"}]
         
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # Enable column access by name
-            cursor = conn.cursor()
+            if cursor is None:
+                cursor = self._get_cursor()
             
             # Determine which table to query based on modality
             if modality == "MR":
@@ -317,12 +862,10 @@ class Vista3DMCPServer:
                 # Default to MR if no modality specified
                 table = "MR"
             
-            # Load schema from JSON file
-            schema_path = Path(__file__).parent / "rtplandb_schema.json"
+            # Load schema from JSON file (parsed once, reloaded when it changes)
             try:
-                with open(schema_path, 'r') as f:
-                    schema = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError) as e:
+                schema = self._load_schema()
+            except (FileNotFoundError, json_utils.JSONDecodeError) as e:
                 return [{"error": f"Could not load schema: {e}"}]
             
             # Get columns from schema for the specific table
@@ -332,27 +875,14 @@ class Vista3DMCPServer:
             table_columns = list(schema["tables"][table]["columns"].keys())
             self.logger.info(f"📋 Using table {table} with {len(table_columns)} columns from schema")
             
-            # Build column list for SELECT statement - use all columns from schema
-            select_columns = []
-            for col in table_columns:
-                # Use snake_case alias for all columns
-                alias = col.lower().replace(' ', '_')
-                select_columns.append(f"{col} as {alias}")
-            
-            self.logger.debug(f"🔍 Selected {len(select_columns)} columns with proper aliases")
+            base_query = self._base_query(table, table_columns)
+            self.logger.debug(f"🔍 Selected {len(table_columns)} columns with proper aliases")
             
             # Build dynamic query based on provided filters
             query_parts = []
             params = []
             requested_sequence_type = None
             
-            base_query = f"""
-            SELECT DISTINCT 
-                {', '.join(select_columns)}
-            FROM {table} 
-            WHERE 1=1
-            """
-            
             # Apply filters based on actual schema columns
             if filters:
                 for filter_key, value in filters.items():
@@ -418,7 +948,12 @@ class Vista3DMCPServer:
                             series_desc = row[key] or ""
                             break
                     
-                    classified_sequences = self._classify_mr_sequence(series_desc)
+                    # Descriptions repeat heavily across series, so each distinct
+                    # one is run through the regex set only once per server
+                    classified_sequences = self._sequence_cache.get(series_desc)
+                    if classified_sequences is None:
+                        classified_sequences = self._classify_mr_sequence(series_desc)
+                        self._sequence_cache[series_desc] = classified_sequences
                     
                     # Check if the requested sequence type matches any classified types
                     requested_type = requested_sequence_type.upper()
@@ -469,7 +1004,6 @@ class Vista3DMCPServer:
                 
                 results.append(result)
             
-            conn.close()
             
             if requested_sequence_type and table == "MR":
                 self.logger.info(f"🎯 Sequence Filtering Summary:")
@@ -484,436 +1018,369 @@ class Vista3DMCPServer:
         except Exception as e:
             return [{"error": f"Unexpected error: {str(e)}"}]
     
-    def handle_mcp_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    def _reply_tail(result: bytes) -> bytes:
+        """Return the part of a JSON-RPC response that follows the id."""
+        return b',"result":' + result + b'}'
+    
+    @staticmethod
+    def _encoded_reply(request_id: Any, tail: bytes) -> bytes:
+        """Build a complete JSON-RPC response from a tail made by _reply_tail."""
+        return b'{"jsonrpc":"2.0","id":' + json_utils.dumps(request_id) + tail
+    
+    @staticmethod
+    def _encoded_error(request_id: Any, code: int, message: str) -> bytes:
+        """Build a complete JSON-RPC error response from ERROR_RESPONSE_TEMPLATE."""
+        return ERROR_RESPONSE_TEMPLATE % (json_utils.dumps(request_id), code, json_utils.dumps(message))
+    
+    @staticmethod
+    def _encode_response(response: Any) -> bytes:
+        """Serialize a response or batch, passing pre-encoded replies through as they are."""
+        if isinstance(response, bytes):
+            return response
+        if isinstance(response, list):
+            return b"[" + b",".join(Vista3DMCPServer._encode_response(item) for item in response) + b"]"
+        return json_utils.dumps(response)
+    
+    def handle_mcp_request(self, request: Dict[str, Any]) -> Union[Dict[str, Any], bytes]:
         """Handle MCP protocol requests."""
         method = request.get("method")
         request_id = request.get("id")
         
         self.logger.debug(f"🔵 MCP Request: {method} (ID: {request_id})")
         
-        if method == "tools/list":
-            self.logger.debug("📋 Returning list of available tools")
-            return {
-                "jsonrpc": "2.0",
-                "id": request.get("id"),
-                "result": {
-                    "tools": [
-                        {
-                            "name": "submit_vista3d_point_task",
-                            "description": "Submit a point-based segmentation task to Vista3D",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "point_coordinates": {
-                                        "type": "array",
-                                        "items": {"type": "integer"},
-                                        "minItems": 3,
-                                        "maxItems": 3,
-                                        "description": "3D coordinates [x, y, z] for the seed point"
-                                    },
-                                    "point_type": {
-                                        "type": "string",
-                                        "enum": ["positive", "negative"],
-                                        "default": "positive",
-                                        "description": "Type of point prompt"
-                                    },
-                                    "additional_points": {
-                                        "type": "array",
-                                        "items": {
-                                            "type": "object",
-                                            "properties": {
-                                                "coordinates": {
-                                                    "type": "array",
-                                                    "items": {"type": "integer"},
-                                                    "minItems": 3,
-                                                    "maxItems": 3
-                                                },
-                                                "type": {
-                                                    "type": "string",
-                                                    "enum": ["positive", "negative"]
-                                                }
-                                            },
-                                            "required": ["coordinates", "type"]
-                                        },
-                                        "description": "Additional points for refinement"
-                                    },
-                                    "input_file": {
-                                        "type": "string",
-                                        "description": "Path to input NIfTI file (required)"
-                                    },
-                                    "output_directory": {
-                                        "type": "string",
-                                        "description": "Path to output directory (required)"
-                                    },
-                                    "patient_id": {
-                                        "type": "string",
-                                        "description": "Patient ID (optional)"
-                                    },
-                                    "series_uid": {
-                                        "type": "string",
-                                        "description": "Series instance UID (optional)"
-                                    }
-                                },
-                                "required": ["point_coordinates", "input_file", "output_directory"]
-                            }
-                        },
-                        {
-                            "name": "check_vista3d_task_status",
-                            "description": "Check the status of a Vista3D task",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "task_id": {
-                                        "type": "string",
-                                        "description": "Task ID to check"
-                                    }
-                                },
-                                "required": ["task_id"]
-                            }
-                        },
-                        {
-                            "name": "submit_full_body_task",
-                            "description": "Submit a full body segmentation task",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "input_file": {
-                                        "type": "string",
-                                        "description": "Path to input NIfTI file (required)"
-                                    },
-                                    "output_directory": {
-                                        "type": "string",
-                                        "description": "Path to output directory (required)"
-                                    },
-                                    "description": {
-                                        "type": "string",
-                                        "description": "Description of the segmentation task (optional)"
-                                    },
-                                    "patient_id": {
-                                        "type": "string",
-                                        "description": "Patient ID (optional)"
-                                    },
-                                    "series_uid": {
-                                        "type": "string",
-                                        "description": "Series instance UID (optional)"
-                                    }
-                                },
-                                "required": ["input_file", "output_directory"]
-                            }
-                        },
-                        {
-                            "name": "query_patient_images",
-                            "description": "Query SQLite database to find patient images using dynamic schema-based filtering",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "modality": {
-                                        "type": "string",
-                                        "description": "Imaging modality (MR, CT, PT) - determines which table to query"
-                                    },
-                                    "filters": {
-                                        "type": "object",
-                                        "description": "Dictionary of column_name: value pairs for filtering. Column names should match database schema. Use 'sequence_type' for MR sequence filtering (T1, T1C, T1NC, T2, FLAIR, DWI, etc.)",
-                                        "additionalProperties": {
-                                            "type": "string"
-                                        }
-                                    }
-                                },
-                                "required": []
-                            }
-                        },
-                        {
-                            "name": "list_available_images",
-                            "description": "List available input images for processing",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "search_directory": {
-                                        "type": "string",
-                                        "description": "Directory path to search for .nii.gz images (optional)"
-                                    }
-                                }
-                            }
-                        }
-                    ]
-                }
-            }
+        handler = self._methods.get(method)
+        if handler is None:
+            return self._encoded_error(request_id, -32601, f"Unknown method: {method}")
+        return handler(request_id, request.get("params", {}))
+    
+    def _h_tools_list(self, request_id: Any, params: Dict[str, Any]) -> bytes:
+        """Return the tool definitions."""
+        self.logger.debug("📋 Returning list of available tools")
+        return self._encoded_reply(request_id, self._tools_list_tail)
+    
+    def _h_initialize(self, request_id: Any, params: Dict[str, Any]) -> bytes:
+        """Answer the initialize handshake."""
+        self.logger.info("🚀 MCP Server Initialize")
+        return self._encoded_reply(request_id, self._initialize_tail)
+    
+    def _h_tools_call(self, request_id: Any, params: Dict[str, Any]) -> Union[Dict[str, Any], bytes]:
+        """Run a tool and wrap its text output in a tools/call result."""
+        tool_name = params.get("name")
+        arguments = params.get("arguments", {})
         
-        elif method == "tools/call":
-            tool_name = request.get("params", {}).get("name")
-            arguments = request.get("params", {}).get("arguments", {})
-            
-            self.logger.info(f"🔧 Tool Call: {tool_name}")
-            self.logger.info(f"📝 Arguments: {json.dumps(arguments, indent=2)}")
-            
-            try:
-                if tool_name == "submit_vista3d_point_task":
-                    # Extract required parameters
-                    point_coordinates = arguments.get("point_coordinates")
-                    input_file = arguments.get("input_file")
-                    output_directory = arguments.get("output_directory")
-                    
-                    # Validate required parameters
-                    if not point_coordinates:
-                        raise ValueError("point_coordinates is required")
-                    if not input_file:
-                        raise ValueError("input_file is required")
-                    if not output_directory:
-                        raise ValueError("output_directory is required")
-                    
-                    # Extract optional parameters
-                    point_type = arguments.get("point_type", "positive")
-                    additional_points = arguments.get("additional_points", [])
-                    patient_id = arguments.get("patient_id")
-                    series_uid = arguments.get("series_uid")
-                    
-                    # Create task
-                    task_params = {
-                        "point_coordinates": point_coordinates,
-                        "input_file": input_file,
-                        "output_directory": output_directory,
-                        "point_type": point_type,
-                        "additional_points": additional_points,
-                        "patient_id": patient_id,
-                        "series_uid": series_uid
-                    }
-                    
-                    task = self.create_vista3d_task(**task_params)
-                    task_file_path = self.submit_task(task)
-                    
-                    return {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": f"Successfully submitted Vista3D task!\n\nTask ID: {task['task_id']}\nTask file: {task_file_path}\nPoint coordinates: {point_coordinates}\nPoint type: {point_type}\n\nTask is now queued for processing by ARTDaemon."
-                                }
-                            ]
-                        }
-                    }
-                
-                elif tool_name == "check_vista3d_task_status":
-                    task_id = arguments.get("task_id")
-                    status = self.check_task_status(task_id)
-                    
-                    status_text = f"Task ID: {task_id}\nStatus: {status['status']}\n"
-                    
-                    if status['status'] == "processed":
-                        if "output_mask" in status:
-                            status_text += f"Output mask: {status['output_mask']}\n"
-                        if "result" in status:
-                            status_text += f"Result details: {json.dumps(status['result'], indent=2)}\n"
-                    elif status['status'] == "pending":
-                        status_text += "Task is still being processed...\n"
-                    elif status['status'] == "failed":
-                        status_text += f"Task failed. Check file: {status.get('failed_file', 'N/A')}\n"
-                    
-                    return {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": status_text
-                                }
-                            ]
-                        }
-                    }
-                
-                elif tool_name == "submit_full_body_task":
-                    # Extract required parameters
-                    input_file = arguments.get("input_file")
-                    output_directory = arguments.get("output_directory")
-                    
-                    # Validate required parameters
-                    if not input_file:
-                        raise ValueError("input_file is required")
-                    if not output_directory:
-                        raise ValueError("output_directory is required")
-                    
-                    # Extract optional parameters
-                    description = arguments.get("description")
-                    patient_id = arguments.get("patient_id")
-                    series_uid = arguments.get("series_uid")
-                    
-                    # Create task
-                    task_params = {
-                        "input_file": input_file,
-                        "output_directory": output_directory,
-                        "description": description,
-                        "patient_id": patient_id,
-                        "series_uid": series_uid
-                    }
-                    
-                    task = self.create_full_body_task(**task_params)
-                    task_file_path = self.submit_task(task)
-                    
-                    return {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": f"Successfully submitted full body segmentation task!\n\nTask ID: {task['task_id']}\nTask file: {task_file_path}\nInput file: {input_file}\nOutput directory: {output_directory}\n\nTask is now queued for processing by ARTDaemon."
-                                }
-                            ]
-                        }
-                    }
-                
-                elif tool_name == "query_patient_images":
-                    # Extract query parameters
-                    modality = arguments.get("modality")
-                    filters = arguments.get("filters", {})
-                    
-                    self.logger.info(f"🔍 Database Query Parameters:")
-                    self.logger.info(f"  modality: {modality}")
-                    self.logger.info(f"  filters: {filters}")
-                    
-                    # Query the database
-                    results = self.query_patient_images(
-                        modality=modality,
-                        filters=filters
-                    )
-                    
-                    self.logger.info(f"📊 Query Results: Found {len(results)} images")
-                    
-                    # Format results for display
-                    if results and "error" not in results[0]:
-                        results_text = f"Found {len(results)} patient image(s):\n"
-                        for i, result in enumerate(results, 1):
-                            # Find patient info using flexible key matching
-                            patient_id = result.get('patientid') or result.get('patient_id', 'N/A')
-                            patient_name = result.get('patientname') or result.get('patient_name', 'N/A')
-                            modality = result.get('modality', 'N/A')
-                            study_date = result.get('studydate') or result.get('study_date', 'N/A')
-                            
-                            results_text += f"\n{i}. Patient: {patient_id} ({patient_name})\n"
-                            results_text += f"   Modality: {modality}\n"
-                            results_text += f"   Study Date: {study_date}\n"
-                            results_text += f"   Input File: {result.get('input_file', 'N/A')}\n"
-                            results_text += f"   Output Directory: {result.get('output_directory', 'N/A')}\n"
-                            if result.get('sequence_name'):
-                                results_text += f"   Sequence: {result.get('sequence_name')}\n"
-                            if result.get('contrast_agent'):
-                                results_text += f"   Contrast: {result.get('contrast_agent')}\n"
-                    else:
-                        if results and "error" in results[0]:
-                            results_text = f"Database query error: {results[0]['error']}"
-                        else:
-                            results_text = "No patient images found matching the criteria."
-                    
-                    return {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": results_text
-                                }
-                            ]
-                        }
-                    }
-                
-                elif tool_name == "list_available_images":
-                    search_directory = arguments.get("search_directory")
-                    images = self.list_available_images(search_directory)
-                    if search_directory:
-                        images_text = f"Available input images in {search_directory}:\n" + "\n".join(f"- {img}" for img in images)
-                    else:
-                        images_text = "Available input images:\n" + "\n".join(f"- {img}" for img in images)
-                    
-                    return {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": images_text
-                                }
-                            ]
-                        }
-                    }
-                
-                else:
-                    return {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "error": {
-                            "code": -32601,
-                            "message": f"Unknown tool: {tool_name}"
-                        }
-                    }
-            
-            except Exception as e:
-                self.logger.error(f"❌ Tool Call Error: {tool_name} failed with: {str(e)}")
-                return {
-                    "jsonrpc": "2.0",
-                    "id": request.get("id"),
-                    "error": {
-                        "code": -32603,
-                        "message": f"Internal error: {str(e)}"
-                    }
-                }
+        self.logger.info(f"🔧 Tool Call: {tool_name}")
+        self.logger.info(f"📝 Arguments: {json_utils.dumps(arguments, indent=True).decode()}")
         
-        elif method == "initialize":
-            self.logger.info("🚀 MCP Server Initialize")
-            return {
-                "jsonrpc": "2.0",
-                "id": request.get("id"),
-                "result": {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {
-                        "tools": {}
-                    },
-                    "serverInfo": {
-                        "name": "vista3d-mcp-server",
-                        "version": "1.0.0"
+        tool = self._tools.get(tool_name)
+        if tool is None:
+            return self._encoded_error(request_id, -32601, f"Unknown tool: {tool_name}")
+        
+        try:
+            validate = self._validators.get(tool_name)
+            if validate:
+                try:
+                    validate(arguments)
+                except fastjsonschema.JsonSchemaException as e:
+                    raise ValueError(f"Invalid arguments: {e.message}")
+            text = tool(arguments)
+        except Exception as e:
+            self.logger.error(f"❌ Tool Call Error: {tool_name} failed with: {str(e)}")
+            return self._encoded_error(request_id, -32603, f"Internal error: {str(e)}")
+        
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "result": {
+                "content": [
+                    {
+                        "type": "text",
+                        "text": text
                     }
-                }
+                ]
             }
+        }
+    
+    def _tool_submit_point(self, arguments: Dict[str, Any]) -> str:
+        """Tool submit_vista3d_point_task: queue a point-prompted segmentation."""
+        # Extract required parameters
+        point_coordinates = arguments.get("point_coordinates")
+        input_file = arguments.get("input_file")
+        output_directory = arguments.get("output_directory")
         
+        # Validate required parameters
+        if not point_coordinates:
+            raise ValueError("point_coordinates is required")
+        if not input_file:
+            raise ValueError("input_file is required")
+        if not output_directory:
+            raise ValueError("output_directory is required")
+        
+        # Extract optional parameters
+        point_type = arguments.get("point_type", "positive")
+        additional_points = arguments.get("additional_points", [])
+        patient_id = arguments.get("patient_id")
+        series_uid = arguments.get("series_uid")
+        
+        # Create task
+        task_params = {
+            "point_coordinates": point_coordinates,
+            "input_file": input_file,
+            "output_directory": output_directory,
+            "point_type": point_type,
+            "additional_points": additional_points,
+            "patient_id": patient_id,
+            "series_uid": series_uid
+        }
+        
+        task = self.create_vista3d_task(**task_params)
+        task_file_path = self.submit_task(task)
+        
+        return f"Successfully submitted Vista3D task!\n\nTask ID: {task['task_id']}\nTask file: {task_file_path}\nPoint coordinates: {point_coordinates}\nPoint type: {point_type}\n\nTask is now queued for processing by ARTDaemon."
+    
+    def _tool_check_status(self, arguments: Dict[str, Any]) -> str:
+        """Tool check_vista3d_task_status: describe where a task is."""
+        task_id = arguments.get("task_id")
+        status = self.check_task_status(task_id)
+        
+        parts = [f"Task ID: {task_id}\nStatus: {status['status']}\n"]
+        
+        if status['status'] == "processed":
+            if "output_mask" in status:
+                parts.append(f"Output mask: {status['output_mask']}\n")
+            if "result" in status:
+                # Shown as written by ARTDaemon rather than re-serialized
+                result_text = status['result_bytes'].decode('utf-8', errors='replace').strip()
+                parts.append(f"Result details: {result_text}\n")
+        elif status['status'] == "pending":
+            parts.append("Task is still being processed...\n")
+        elif status['status'] == "failed":
+            if "message" in status:
+                parts.append(f"Task failed. {status['message']}\n")
+            else:
+                parts.append(f"Task failed. Check file: {status.get('failed_file', 'N/A')}\n")
+        
+        return "".join(parts)
+    
+    def _tool_submit_full_body(self, arguments: Dict[str, Any]) -> str:
+        """Tool submit_full_body_task: queue a full body segmentation."""
+        # Extract required parameters
+        input_file = arguments.get("input_file")
+        output_directory = arguments.get("output_directory")
+        
+        # Validate required parameters
+        if not input_file:
+            raise ValueError("input_file is required")
+        if not output_directory:
+            raise ValueError("output_directory is required")
+        
+        # Extract optional parameters
+        description = arguments.get("description")
+        patient_id = arguments.get("patient_id")
+        series_uid = arguments.get("series_uid")
+        
+        # Create task
+        task_params = {
+            "input_file": input_file,
+            "output_directory": output_directory,
+            "description": description,
+            "patient_id": patient_id,
+            "series_uid": series_uid
+        }
+        
+        task = self.create_full_body_task(**task_params)
+        task_file_path = self.submit_task(task)
+        
+        return f"Successfully submitted full body segmentation task!\n\nTask ID: {task['task_id']}\nTask file: {task_file_path}\nInput file: {input_file}\nOutput directory: {output_directory}\n\nTask is now queued for processing by ARTDaemon."
+    
+    def _tool_query_patient_images(self, arguments: Dict[str, Any]) -> str:
+        """Tool query_patient_images: list matching series from RTPlanDB."""
+        # Extract query parameters
+        modality = arguments.get("modality")
+        filters = arguments.get("filters", {})
+        
+        self.logger.info(f"🔍 Database Query Parameters:")
+        self.logger.info(f"  modality: {modality}")
+        self.logger.info(f"  filters: {filters}")
+        
+        # Query the database
+        results = self.query_patient_images(
+            modality=modality,
+            filters=filters
+        )
+        
+        self.logger.info(f"📊 Query Results: Found {len(results)} images")
+        
+        # Format results for display
+        if results and "error" not in results[0]:
+            results_text = f"Found {len(results)} patient image(s):\n"
+            for i, result in enumerate(results, 1):
+                # Find patient info using flexible key matching
+                patient_id = result.get('patientid') or result.get('patient_id', 'N/A')
+                patient_name = result.get('patientname') or result.get('patient_name', 'N/A')
+                modality = result.get('modality', 'N/A')
+                study_date = result.get('studydate') or result.get('study_date', 'N/A')
+        
+                results_text += f"\n{i}. Patient: {patient_id} ({patient_name})\n"
+                results_text += f"   Modality: {modality}\n"
+                results_text += f"   Study Date: {study_date}\n"
+                results_text += f"   Input File: {result.get('input_file', 'N/A')}\n"
+                results_text += f"   Output Directory: {result.get('output_directory', 'N/A')}\n"
+                if result.get('sequence_name'):
+                    results_text += f"   Sequence: {result.get('sequence_name')}\n"
+                if result.get('contrast_agent'):
+                    results_text += f"   Contrast: {result.get('contrast_agent')}\n"
         else:
-            return {
-                "jsonrpc": "2.0",
-                "id": request.get("id"),
-                "error": {
-                    "code": -32601,
-                    "message": f"Unknown method: {method}"
-                }
-            }
+            if results and "error" in results[0]:
+                results_text = f"Database query error: {results[0]['error']}"
+            else:
+                results_text = "No patient images found matching the criteria."
+        
+        return results_text
+    
+    def _tool_list_available_images(self, arguments: Dict[str, Any]) -> str:
+        """Tool list_available_images: list .nii.gz inputs."""
+        search_directory = arguments.get("search_directory")
+        images = self.list_available_images(search_directory)
+        if search_directory:
+            images_text = f"Available input images in {search_directory}:\n" + "\n".join(f"- {img}" for img in images)
+        else:
+            images_text = "Available input images:\n" + "\n".join(f"- {img}" for img in images)
+        
+        return images_text
+    
+    def _handle_request_safely(self, request: Dict[str, Any]) -> Union[Dict[str, Any], bytes]:
+        """Handle one MCP request, turning exceptions into JSON-RPC errors."""
+        try:
+            return self.handle_mcp_request(request)
+        except Exception as e:
+            # Send proper error response
+            request_id = request.get("id") if isinstance(request, dict) else None
+            return self._encoded_error(request_id, -32603, f"Internal error: {str(e)}")
+    
+    def handle_line(self, line) -> Optional[Any]:
+        """Answer one newline-delimited request or batch; None for unparsable input."""
+        # Blank lines and stray text are the common junk on stdin; rejecting
+        # them on the first byte skips raising and catching a decode error
+        stripped = line.lstrip()
+        if not stripped or stripped[0] not in JSON_VALUE_START:
+            return None
+        try:
+            request = json_utils.loads(line)
+        except json_utils.JSONDecodeError:
+            # Invalid JSON input
+            return None
+        
+        if isinstance(request, list):
+            # JSON-RPC batch: answer with an array in the same order
+            if request:
+                return [self._handle_request_safely(item) for item in request]
+            return EMPTY_BATCH_RESPONSE
+        return self._handle_request_safely(request)
     
     def run(self):
         """Run the MCP server using stdio transport."""
+        # Raw bytes both ways: requests go straight to the JSON parser and
+        # replies are encoded bytes, with no text-mode codec in between.
+        # Each read takes whatever has arrived into one reused buffer, so a
+        # burst of requests is parsed from one syscall and its replies leave
+        # in one write. A single writer thread drains replies in FIFO order,
+        # so the next read is parsed while the previous replies are still
+        # being flushed
+        out_queue = queue.SimpleQueue()
+        writer = threading.Thread(target=self._stdout_writer, args=(out_queue,), name="stdout-writer", daemon=True)
+        writer.start()
+        stdin_raw = sys.stdin.buffer.raw
+        read_buffer = bytearray(STDIN_READ_SIZE)
+        read_view = memoryview(read_buffer)
+        pending = bytearray()
         try:
-            for line in sys.stdin:
-                try:
-                    request = json.loads(line.strip())
-                    response = self.handle_mcp_request(request)
-                    print(json.dumps(response), flush=True)
-                except json.JSONDecodeError:
-                    # Invalid JSON input
-                    continue
-                except Exception as e:
-                    # Send proper error response
-                    error_response = {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id") if 'request' in locals() else None,
-                        "error": {
-                            "code": -32603,
-                            "message": f"Internal error: {str(e)}"
-                        }
-                    }
-                    print(json.dumps(error_response), flush=True)
+            while True:
+                n = stdin_raw.readinto(read_buffer)
+                if not n:
+                    break
+                pending += read_view[:n]
+                replies = []
+                start = 0
+                newline = pending.find(b"\n")
+                while newline != -1:
+                    response = self.handle_line(bytes(pending[start:newline]))
+                    if response is not None:
+                        replies.append(self._encode_response(response) + b"\n")
+                    start = newline + 1
+                    newline = pending.find(b"\n", start)
+                del pending[:start]
+                if replies:
+                    out_queue.put(b"".join(replies))
+            
+            # A last request without a trailing newline
+            if pending.strip():
+                response = self.handle_line(bytes(pending))
+                if response is not None:
+                    out_queue.put(self._encode_response(response) + b"\n")
         except KeyboardInterrupt:
             pass
         except Exception as e:
             print(f"Server error: {e}", file=sys.stderr)
+        finally:
+            out_queue.put(None)  # Sentinel: write what is queued, then stop
+            writer.join()
+            self.flush_writes()
+    
+    @staticmethod
+    def _stdout_writer(out_queue: queue.SimpleQueue):
+        """Write queued reply lines to stdout until the None sentinel arrives."""
+        stdout = sys.stdout.buffer
+        while True:
+            # Take everything queued so far and flush once, so replies that
+            # piled up during a slow write go out together
+            batch = [out_queue.get()]
+            while batch[-1] is not None and not out_queue.empty():
+                batch.append(out_queue.get())
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            try:
+                if batch:
+                    stdout.write(b"".join(batch))
+                    stdout.flush()
+            except OSError:
+                return  # Client closed its end; nothing more can be delivered
+            if done:
+                return
+    
+    def serve_socket(self, socket_path: str):
+        """Serve newline-delimited JSON-RPC on a Unix domain socket, one client at a time."""
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # Left over from a previous run
+        
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            # Created owner-only rather than chmod-ed after bind, which would
+            # leave it open to other users until then. The umask is process
+            # wide, but no task file is being written before the first client
+            old_umask = os.umask(0o077)
+            try:
+                listener.bind(socket_path)
+            finally:
+                os.umask(old_umask)
+            listener.listen()
+            self.logger.info(f"Listening on {socket_path}")
+            while True:
+                conn, _ = listener.accept()
+                with conn, conn.makefile("rwb") as stream:
+                    for line in stream:
+                        response = self.handle_line(line)
+                        if response is not None:
+                            stream.write(self._encode_response(response) + b"\n")
+                            stream.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.flush_writes()
 
 
 def parse_args():
@@ -950,6 +1417,12 @@ Environment Variables:
         help="Colon-separated directories to search for input images (also sets VISTA3D_IMAGE_DIRS)"
     )
     
+    parser.add_argument(
+        "--socket",
+        type=str,
+        help="Serve on this Unix domain socket instead of stdio (used by vista3d_cli.py --daemon)"
+    )
+    
     return parser.parse_args()
 
 
@@ -960,9 +1433,24 @@ if __name__ == "__main__":
     if args.image_dirs:
         os.environ["VISTA3D_IMAGE_DIRS"] = args.image_dirs
     
+    # Clients stop the server with SIGTERM, and queued task files must be
+    # flushed first. A Python handler can stay pending while the main thread
+    # blocks on stdin, so SIGTERM is blocked in all threads (set before the
+    # server starts any, as the mask is inherited) and taken by one waiter
+    sigterm_waiter = hasattr(signal, "pthread_sigmask")
+    if sigterm_waiter:
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     try:
         server = Vista3DMCPServer(tasks_base_path=args.tasks_path)
-        server.run()
+        if sigterm_waiter:
+            threading.Thread(target=server.exit_on_sigterm, name="sigterm", daemon=True).start()
+        if args.socket:
+            server.serve_socket(args.socket)
+        else:
+            server.run()
     except ValueError as e:
         print(f"Configuration error: {e}", file=sys.stderr)
         sys.exit(1)
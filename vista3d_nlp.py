@@ -134,7 +134,7 @@ class Vista3DNLPClient:
             # Try to infer from context
             if re.search(r'\d+\s+\d+\s+\d+', text):  # Has coordinates
                 command_type = 'submit'
-            elif re.search(r'vista3d_point_\d+', text):  # Has task ID
+            elif re.search(r'vista3d_point_\d+(?:_\d+)*', text):  # Has task ID
                 command_type = 'status'
             else:
                 command_type = 'list'
@@ -163,7 +163,7 @@ class Vista3DNLPClient:
             
         elif command_type == 'status':
             # Extract task ID
-            task_id_match = re.search(r'(vista3d_point_\d+)', text)
+            task_id_match = re.search(r'(vista3d_point_\d+(?:_\d+)*)', text)
             if task_id_match:
                 result['task_id'] = task_id_match.group(1)
                 